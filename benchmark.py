@@ -0,0 +1,403 @@
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import signal
+import logging
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+import subprocess
+
+TASK_MANAGER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_manager.py")
+
+
+def run_cli(args, cwd):
+    """Run task_manager.py once in a fresh interpreter and return its wall time in milliseconds."""
+    command = [sys.executable, *args] if args[0] == "-c" else [sys.executable, TASK_MANAGER, *args]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"'{' '.join(args)}' failed: {result.stderr.strip()}")
+    return elapsed
+
+
+def benchmark_startup(runs, budget_ms):
+    """Report cold-start wall time per CLI subcommand."""
+    workdir = tempfile.mkdtemp(prefix="task_manager_bench_")
+    try:
+        commands = {
+            "python": lambda i: ["-c", "pass"],
+            "help": lambda i: ["--help"],
+            "list": lambda i: ["list"],
+            "add": lambda i: ["add", "--interval", str(i + 1), "--unit", "minutes", "--task-type", "organize_files", "--directory", workdir],
+            "remove": lambda i: ["remove", "--task-name", f"organize_files_task_{i + 1}"],
+        }
+        results = {}
+        for name, build_args in commands.items():
+            timings = [run_cli(build_args(i), workdir) for i in range(runs)]
+            results[name] = {
+                "min_ms": round(min(timings), 1),
+                "median_ms": round(statistics.median(timings), 1),
+                "max_ms": round(max(timings), 1),
+            }
+
+        print(f"Cold-start wall time over {runs} runs (budget {budget_ms} ms for list; 'python' is the bare interpreter):")
+        for name, result in results.items():
+            print(f"  {name:<8} min {result['min_ms']:>8} ms   median {result['median_ms']:>8} ms   max {result['max_ms']:>8} ms")
+        print(json.dumps(results))
+        return results["list"]["median_ms"] <= budget_ms
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+SYNTHETIC_EXTENSIONS = [".jpg", ".png", ".mp4", ".pdf", ".docx", ".txt", ".mp3", ".zip", ".py", ".csv", ".json", ".bin", ""]
+
+
+def make_synthetic_directory(directory, count, seed=0):
+    """Create `count` empty files with a mix of known and unknown extensions."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        open(os.path.join(directory, f"file_{i:07d}{rng.choice(SYNTHETIC_EXTENSIONS)}"), "w").close()
+
+
+def legacy_organize_files(directory, file_types, logger, log_entries):
+    """The listdir/isfile/linear-scan organize_files implementation, kept as the benchmark reference."""
+    files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
+    for file in files:
+        file_extension = os.path.splitext(file)[1].lower()
+        category = "Others"
+        for folder_name, extensions in file_types.items():
+            if file_extension in extensions:
+                category = folder_name
+                break
+        category_folder = os.path.join(directory, category)
+        if not os.path.exists(category_folder):
+            os.makedirs(category_folder)
+        shutil.move(os.path.join(directory, file), os.path.join(category_folder, file))
+        logger.info(f"Moved '{file}' to '{category}' folder.")
+        log_entries.append({"file": file, "category": category})
+
+
+def benchmark_organize(count):
+    """Compare the legacy and current organize_files on a synthetic directory of `count` files."""
+    import task_manager_core as task_manager
+
+    workdir = tempfile.mkdtemp(prefix="task_manager_bench_")
+    cwd = os.getcwd()
+    try:
+        # Keep the task store, log file and spool the manager creates out of the caller's directory
+        os.chdir(workdir)
+        manager = task_manager.TaskManager(start_services=False)
+        manager.logger.setLevel(logging.WARNING)
+        manager.log_writer = task_manager.BufferedLogWriter()
+
+        legacy_dir = os.path.join(workdir, "legacy")
+        make_synthetic_directory(legacy_dir, count)
+        start = time.perf_counter()
+        legacy_organize_files(legacy_dir, manager.file_types, manager.logger, [])
+        legacy_seconds = time.perf_counter() - start
+
+        current_dir = os.path.join(workdir, "current")
+        make_synthetic_directory(current_dir, count)
+        start = time.perf_counter()
+        manager.organize_files(current_dir)
+        current_seconds = time.perf_counter() - start
+
+        print(f"organize_files on {count} files:")
+        print(f"  legacy   {legacy_seconds:8.2f} s   {count / legacy_seconds:10.0f} files/s")
+        print(f"  current  {current_seconds:8.2f} s   {count / current_seconds:10.0f} files/s")
+        print(f"  speedup  {legacy_seconds / current_seconds:8.2f}x")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class SMTPSink:
+    """Local SMTP server that accepts and discards mail, standing in for a real relay.
+
+    Each message's final reply is delayed by `latency` seconds and held back so no
+    more than `max_rate` messages per second are accepted in total. A random
+    `transient_rate` share of messages is answered 451 and a `permanent_rate` share
+    554. It offers PIPELINING and accepts any AUTH; STARTTLS is refused, so point
+    the client at it with SMTP_STARTTLS=false.
+    """
+
+    def __init__(self, latency=0.0, transient_rate=0.0, permanent_rate=0.0, max_rate=None, seed=0):
+        self.latency = latency
+        self.transient_rate = transient_rate
+        self.permanent_rate = permanent_rate
+        self.max_rate = max_rate
+        self.random = random.Random(seed)
+        self.stats = {"connections": 0, "accepted": 0, "transient": 0, "permanent": 0}
+        self._next_slot = 0.0
+
+    async def _accept(self):
+        """Wait out the latency and rate cap, then return the reply for a complete message."""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.max_rate:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.max_rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+        draw = self.random.random()
+        if draw < self.permanent_rate:
+            self.stats["permanent"] += 1
+            return b"554 5.6.0 Message rejected by sink\r\n"
+        if draw < self.permanent_rate + self.transient_rate:
+            self.stats["transient"] += 1
+            return b"451 4.3.0 Try again later\r\n"
+        self.stats["accepted"] += 1
+        return b"250 2.0.0 Ok\r\n"
+
+    async def handle(self, reader, writer):
+        self.stats["connections"] += 1
+        writer.write(b"220 benchmark sink ESMTP\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command == b"EHLO":
+                    writer.write(b"250-benchmark sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 AUTH PLAIN LOGIN\r\n")
+                elif command == b"DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    while True:
+                        line = await reader.readline()
+                        if not line or line == b".\r\n":
+                            break
+                    if not line:
+                        break
+                    writer.write(await self._accept())
+                elif command == b"AUTH":
+                    writer.write(b"235 2.7.0 Authentication successful\r\n")
+                elif command == b"STARTTLS":
+                    writer.write(b"454 4.7.0 TLS not available\r\n")
+                elif command == b"QUIT":
+                    writer.write(b"221 2.0.0 Bye\r\n")
+                    await writer.drain()
+                    break
+                elif command in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                    writer.write(b"250 2.0.0 Ok\r\n")
+                else:
+                    writer.write(b"502 5.5.2 Command not recognized\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, duration=None):
+        """Serve until `duration` seconds pass, or until interrupted; return the stats."""
+        server = await asyncio.start_server(self.handle, host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        async with server:
+            try:
+                await asyncio.wait_for(stop.wait(), duration)
+            except asyncio.TimeoutError:
+                pass
+        return self.stats
+
+
+def run_sink(host, port, latency_ms, transient_rate, permanent_rate, max_rate, duration=None):
+    """Run an SMTPSink in the foreground and print its stats as JSON when it stops."""
+    sink = SMTPSink(latency_ms / 1000, transient_rate, permanent_rate, max_rate)
+    print(f"SMTP sink listening on {host}:{port}", flush=True)
+    print(json.dumps(asyncio.run(sink.serve(host, port, duration))), flush=True)
+
+
+class CampaignLogWriter:
+    """Log writer keeping only the campaign summary, so per-message entries don't weigh on peak RSS."""
+
+    def __init__(self):
+        self.summary = None
+
+    def write(self, log_entry):
+        if log_entry["status"] == "Campaign completed":
+            self.summary = log_entry["details"]
+
+    def close(self):
+        pass
+
+
+def run_email_campaign(recipients, engine, workers, port):
+    """Send one synthetic campaign to the sink on `port` and print its measurements as JSON.
+
+    Runs in its own interpreter (see benchmark_email), so peak RSS is this campaign's alone.
+    """
+    os.environ.update(
+        SMTP_HOST="127.0.0.1",
+        SMTP_PORT=str(port),
+        SMTP_STARTTLS="false",
+        SENDER_EMAIL="benchmark@example.com",
+        EMAIL_RETRY_BASE="0.1",
+    )
+    os.environ.pop("SENDER_PASSWORD", None)
+    import task_manager_core as task_manager
+
+    # Time each SMTP transaction, from MAIL FROM to the reply to the end of data
+    latencies = []
+    send_message = task_manager.SMTPPool._send_message
+    deliver = task_manager.AsyncSMTPEngine._deliver
+
+    def timed_send_message(server, from_addr, to_addr, message):
+        start = time.perf_counter()
+        try:
+            return send_message(server, from_addr, to_addr, message)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    async def timed_deliver(self, session, from_addr, to_addr, message):
+        start = time.perf_counter()
+        try:
+            return await deliver(self, session, from_addr, to_addr, message)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    task_manager.SMTPPool._send_message = staticmethod(timed_send_message)
+    task_manager.AsyncSMTPEngine._deliver = timed_deliver
+
+    workdir = tempfile.mkdtemp(prefix="task_manager_bench_")
+    try:
+        os.chdir(workdir)
+        with open("recipients.csv", "w") as f:
+            f.write("email,name\n")
+            f.writelines(f"user{i:07d}@example.com,User {i}\n" for i in range(recipients))
+        manager = task_manager.TaskManager(start_services=False)
+        manager.logger.setLevel(logging.CRITICAL)
+        manager.log_writer = CampaignLogWriter()
+
+        start = time.perf_counter()
+        manager.send_email("recipients.csv", "Benchmark for {name}", "Hello {name},\n\nThis is a benchmark message.\n", workers=workers, engine=engine)
+        total_seconds = time.perf_counter() - start
+        manager.smtp_pool.close()
+
+        summary = manager.log_writer.summary
+        latencies.sort()
+        print(json.dumps({
+            "recipients": recipients,
+            "engine": engine,
+            "workers": workers,
+            "sent": summary["sent"],
+            "failed": summary["failed"],
+            "retried": summary["retried"],
+            "send_seconds": summary["elapsed_seconds"],
+            "total_seconds": round(total_seconds, 3),
+            "messages_per_second": summary["messages_per_second"],
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+            "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2) if latencies else None,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def benchmark_email(recipient_counts, engines, workers, port, latency_ms, transient_rate, permanent_rate, max_rate):
+    """Drive synthetic campaigns through a local SMTP sink and report throughput, latency and peak RSS."""
+    sink = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "sink", "--port", str(port), "--latency-ms", str(latency_ms),
+         "--transient-rate", str(transient_rate), "--permanent-rate", str(permanent_rate)] + (["--max-rate", str(max_rate)] if max_rate else []),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        # The sink prints its address once it is listening
+        sink.stdout.readline()
+        results = []
+        for recipients in recipient_counts:
+            for engine in engines:
+                result = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "email-campaign", "--recipients", str(recipients), "--engine", engine, "--workers", str(workers), "--port", str(port)],
+                    capture_output=True,
+                    text=True,
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(f"Campaign of {recipients} recipients ({engine}) failed: {result.stderr.strip()}")
+                results.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    finally:
+        sink.send_signal(signal.SIGTERM)
+        sink_stats = sink.communicate()[0].strip().splitlines()[-1]
+
+    print(f"send_email campaigns through the local SMTP sink ({workers} workers, latency {latency_ms} ms, max rate {max_rate or 'unlimited'}):")
+    for r in results:
+        print(f"  {r['recipients']:>7} recipients  {r['engine']:<8} {r['messages_per_second']:>9} msg/s   p50 {r['p50_ms']:>7} ms   p99 {r['p99_ms']:>7} ms   "
+              f"peak RSS {r['peak_rss_mb']:>7} MB   sent {r['sent']}, failed {r['failed']}, retried {r['retried']}")
+    print(f"  sink: {sink_stats}")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Task Manager benchmarks", formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    startup_parser = subparsers.add_parser("startup", help="Measure CLI cold-start time per subcommand")
+    startup_parser.add_argument("--runs", type=int, default=5, help="Runs per subcommand")
+    startup_parser.add_argument("--budget-ms", type=float, default=100, help="Median wall time budget for 'list'")
+
+    organize_parser = subparsers.add_parser("organize", help="Compare organize_files against the legacy implementation")
+    organize_parser.add_argument("--files", type=int, default=100000, help="Number of synthetic files")
+
+    sink_parser = subparsers.add_parser("sink", help="Run a local SMTP server that accepts and discards mail")
+    sink_parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    sink_parser.add_argument("--port", type=int, default=2525, help="Port to listen on")
+    sink_parser.add_argument("--latency-ms", type=float, default=0, help="Delay before accepting each message")
+    sink_parser.add_argument("--transient-rate", type=float, default=0, help="Share of messages answered 451 (e.g. 0.01)")
+    sink_parser.add_argument("--permanent-rate", type=float, default=0, help="Share of messages answered 554")
+    sink_parser.add_argument("--max-rate", type=float, help="Messages accepted per second, at most")
+    sink_parser.add_argument("--duration", type=float, help="Seconds to run (default: until interrupted)")
+
+    email_parser = subparsers.add_parser("email", help="Measure send_email campaigns against the local SMTP sink")
+    email_parser.add_argument("--recipients", type=int, nargs="+", default=[1000, 10000, 100000], help="Campaign sizes")
+    email_parser.add_argument("--engines", type=str, nargs="+", default=["threads", "asyncio"], choices=["threads", "asyncio"], help="Delivery engines to compare")
+    email_parser.add_argument("--workers", type=int, default=8, help="Worker threads or concurrent sessions")
+    email_parser.add_argument("--port", type=int, default=2525, help="Port for the sink")
+    email_parser.add_argument("--latency-ms", type=float, default=0, help="Sink delay before accepting each message")
+    email_parser.add_argument("--transient-rate", type=float, default=0, help="Share of messages the sink answers 451")
+    email_parser.add_argument("--permanent-rate", type=float, default=0, help="Share of messages the sink answers 554")
+    email_parser.add_argument("--max-rate", type=float, help="Messages the sink accepts per second, at most")
+
+    # One campaign in a fresh interpreter, run by the email benchmark
+    campaign_parser = subparsers.add_parser("email-campaign")
+    campaign_parser.add_argument("--recipients", type=int, required=True)
+    campaign_parser.add_argument("--engine", type=str, required=True)
+    campaign_parser.add_argument("--workers", type=int, required=True)
+    campaign_parser.add_argument("--port", type=int, required=True)
+
+    parser.epilog = """
+Example usage:
+  python benchmark.py startup --runs 10
+  python benchmark.py organize --files 100000
+  python benchmark.py email --recipients 1000 10000 100000 --workers 8
+  python benchmark.py email --recipients 10000 --engines asyncio --workers 50 --latency-ms 20 --transient-rate 0.01
+  python benchmark.py sink --port 2525 --latency-ms 5 --max-rate 500
+    (then run task_manager.py with SMTP_HOST=127.0.0.1 SMTP_PORT=2525 SMTP_STARTTLS=false)
+"""
+
+    args = parser.parse_args()
+
+    if args.command == "startup":
+        within_budget = benchmark_startup(args.runs, args.budget_ms)
+        sys.exit(0 if within_budget else 1)
+    elif args.command == "organize":
+        benchmark_organize(args.files)
+    elif args.command == "sink":
+        run_sink(args.host, args.port, args.latency_ms, args.transient_rate, args.permanent_rate, args.max_rate, args.duration)
+    elif args.command == "email":
+        benchmark_email(args.recipients, args.engines, args.workers, args.port, args.latency_ms, args.transient_rate, args.permanent_rate, args.max_rate)
+    elif args.command == "email-campaign":
+        run_email_campaign(args.recipients, args.engine, args.workers, args.port)
+    else:
+        parser.print_help()
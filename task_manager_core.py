@@ -0,0 +1,4135 @@
+import os
+import re
+import sys
+import random
+import errno
+import shutil
+import string
+import time
+import logging
+import json
+import sqlite3
+import hashlib
+import socket
+import fnmatch
+import threading
+import argparse
+import socketserver
+from datetime import datetime
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import queue
+import heapq
+import itertools
+import atexit
+import signal
+from dotenv import load_dotenv
+
+# Heavy dependencies (pandas, requests, bs4, fpdf, docx, pymongo, apscheduler,
+# smtplib, the email package and the archive modules) are imported inside the methods that use
+# them, so that the list/add/remove commands start quickly.
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_CONTROL_SOCKET = "task_manager.sock"
+
+# MongoDB write error code for a duplicate key: the document is already stored
+DUPLICATE_KEY_ERROR = 11000
+
+# Scheduler executor pools and the task types routed to each by default
+EXECUTOR_POOLS = {
+    "network": ("thread", int(os.getenv("NETWORK_POOL_SIZE", "10"))),
+    "files": ("thread", int(os.getenv("FILES_POOL_SIZE", "4"))),
+    "cpu": ("process", int(os.getenv("CPU_POOL_SIZE", str(os.cpu_count() or 2)))),
+}
+EXECUTOR_ROUTES = {
+    "send_email": "network",
+    "get_gold_rate": "network",
+    "organize_files": "files",
+    "delete_files": "files",
+    "convert_file": "cpu",
+    "compress_files": "cpu",
+}
+JOB_OPTIONS = ("executor", "max_instances", "coalesce", "misfire_grace_time")
+
+# Per-task I/O throttling options (see IOGovernor), shared by the bulk file tasks
+IO_OPTIONS = ("io_ops", "io_bytes", "io_idle")
+
+# Task types whose runs are throttled by an IOGovernor; its budgets live in one process, so these stay on thread pools when limited
+IO_TASKS = ("organize_files", "delete_files", "compress_files")
+
+# organize_files options that can be set per task
+ORGANIZE_OPTIONS = ("recursive", "include", "exclude", "workers", "layout", "max_per_folder", "sniff", "dedup", *IO_OPTIONS)
+
+# Optional delete_files keyword arguments stored with a task
+DELETE_OPTIONS = ("exclude", "prune", "max_depth", "workers", "index", "quota", "quota_low", "evict_by", *IO_OPTIONS)
+
+# Linux ioprio_set/ioprio_get syscall numbers by machine, for idle I/O priority
+IOPRIO_SYSCALLS = {"x86_64": (251, 252), "aarch64": (30, 31), "i386": (289, 290), "i686": (289, 290), "armv7l": (314, 315)}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+# Optional send_email keyword arguments stored with a task
+EMAIL_OPTIONS = ("workers", "rate", "campaign", "engine")
+
+# send_email delivery engines for lists: SMTPPool sessions on worker threads, or AsyncSMTPEngine sessions on one event loop
+EMAIL_ENGINES = ("threads", "asyncio")
+
+# Message template placeholders: {column} or {column|default}; {{ and }} are literal braces
+TEMPLATE_TOKENS = re.compile(r"\{\{|\}\}|\{(\w+)(?:\|([^{}]*))?\}")
+
+# Accepted recipient address format, and rows read per chunk from a CSV/XLSX recipient list
+EMAIL_PATTERN = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
+EMAIL_REGEX = re.compile(EMAIL_PATTERN)
+RECIPIENT_CHUNK_SIZE = 50000
+
+# Attachments are base64-encoded in reads of this size (a multiple of 57 bytes, one 76-character line);
+# encoded parts larger than ATTACHMENT_MEMORY_LIMIT are kept in a temporary file instead of memory
+ATTACHMENT_READ_SIZE = 57 * 16 * 1024
+ATTACHMENT_MEMORY_LIMIT = 8 * 1024 * 1024
+
+# Seconds per unit accepted by parse_rate
+RATE_UNITS = {"s": 1, "sec": 1, "second": 1, "m": 60, "min": 60, "minute": 60, "h": 3600, "hour": 3600}
+
+# Binary multipliers accepted by parse_size
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+# Duplicate handling for organize_files, and where moved duplicates go
+DEDUP_ACTIONS = ("report", "hardlink", "move", "delete")
+DUPLICATES_FOLDER = "Duplicates"
+HASH_CHUNK_SIZE = 1024 * 1024
+QUICK_HASH_BYTES = 4096
+
+# Placeholders available in organize_files destination layouts
+LAYOUT_FIELDS = {"category", "YYYY", "MM", "DD", "hash"}
+
+# Magic-byte signatures as (offset, bytes, extension or category), checked in order
+MAGIC_SIGNATURES = [
+    (0, b"\xff\xd8\xff", ".jpg"),
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"GIF87a", ".gif"),
+    (0, b"GIF89a", ".gif"),
+    (0, b"II*\x00", ".tiff"),
+    (0, b"MM\x00*", ".tiff"),
+    (0, b"%PDF-", ".pdf"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", ".doc"),
+    (0, b"PK\x03\x04", ".zip"),
+    (0, b"Rar!\x1a\x07", ".rar"),
+    (0, b"7z\xbc\xaf\x27\x1c", ".7z"),
+    (0, b"\x1f\x8b", ".gz"),
+    (257, b"ustar", ".tar"),
+    (0, b"ID3", ".mp3"),
+    (0, b"\xff\xfb", ".mp3"),
+    (0, b"fLaC", ".flac"),
+    (0, b"OggS", ".ogg"),
+    (8, b"WAVE", ".wav"),
+    (8, b"AVI ", ".avi"),
+    (4, b"ftypqt", ".mov"),
+    (4, b"ftyp", ".mp4"),
+    (0, b"\x1a\x45\xdf\xa3", ".mkv"),
+    (0, b"FLV", ".flv"),
+    (0, b"MZ", ".exe"),
+    (0, b"\x7fELF", "Executables"),
+    (0, b"#!", ".sh"),
+    (0, b"SQLite format 3\x00", ".db"),
+    (0, b"<?xml", ".xml"),
+    (0, b"<!DOCTYPE html", ".html"),
+    (0, b"<html", ".html"),
+]
+SNIFF_BYTES = 512
+
+# Signatures shared by many formats (zip-based Office and OpenDocument files, OLE documents and
+# installers, XML such as SVG, scripts of any language): these only classify unrecognised extensions
+CONTAINER_SIGNATURES = {".zip", ".doc", ".xml", ".sh"}
+
+# Journal file states, in the order an organize run goes through them
+JOURNAL_STATES = ("pending", "complete", "undone")
+
+# Moves an organize worker does before handing their indexes to the journal in one call
+JOURNAL_MARK_BATCH = 100
+
+# Task types that support watch mode, and the detail holding the directory to watch
+WATCHABLE_TASKS = {"organize_files": "directory", "convert_file": "input_dir"}
+
+def parse_size(value):
+    """Parse a byte count such as 1048576, '500M' or '200G' (binary units)."""
+    if isinstance(value, int):
+        return value
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size '{value}': use a byte count or a number with K, M, G or T")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_rate(value):
+    """Parse a rate such as 5, '10/s', '600/min' or '3600/h' into events per second (None stays None)."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    count, _, unit = str(value).partition("/")
+    try:
+        return float(count) / RATE_UNITS[unit.strip().lower() or "s"]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate '{value}': use a number per second, or e.g. '10/s', '600/min', '3600/h'") from None
+
+
+def allocated_bytes(stat_result):
+    """Disk space a file takes up: its allocated blocks where the platform reports them, else its size."""
+    blocks = getattr(stat_result, "st_blocks", None)
+    return stat_result.st_size if blocks is None else blocks * 512
+
+
+def read_recipient_chunks(path, chunksize):
+    """Yield a CSV/XLSX recipient list as DataFrames of at most `chunksize` rows, all columns as strings."""
+    import pandas as pd
+
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunksize, dtype=str, keep_default_na=False)
+    elif path.endswith(".xlsx"):
+        # pandas can't read a worksheet in chunks, so stream its rows through openpyxl's read-only mode
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            # Name blank and repeated headers much as read_csv does ("Unnamed: 2", "email.1"), so columns stay unique
+            columns, seen = [], Counter()
+            for index, value in enumerate(next(rows, ())):
+                column = f"Unnamed: {index}" if value is None or str(value).strip() == "" else str(value)
+                count = seen[column]
+                while count:
+                    seen[column] = count + 1
+                    column = f"{column}.{count}"
+                    count = seen[column]
+                seen[column] += 1
+                columns.append(column)
+            batch = []
+            for row in rows:
+                batch.append(["" if value is None else str(value) for value in row[:len(columns)]])
+                if len(batch) == chunksize:
+                    yield pd.DataFrame(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=columns)
+        finally:
+            workbook.close()
+    else:
+        raise ValueError("Unsupported email list format. Only CSV and XLSX are supported.")
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilling at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take `tokens` and return the seconds to wait before using them, without sleeping.
+
+        Requests larger than the capacity run the bucket into debt.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self, tokens=1):
+        """Take `tokens`, sleeping until the bucket has refilled, and return the seconds slept."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+_ioprio_calls = None
+
+
+def ioprio_calls():
+    """Return (set, get) functions for the calling thread's I/O priority, or None where unsupported."""
+    global _ioprio_calls
+    if _ioprio_calls is None:
+        _ioprio_calls = False
+        numbers = IOPRIO_SYSCALLS.get(os.uname().machine) if sys.platform.startswith("linux") else None
+        if numbers:
+            import ctypes
+
+            libc = ctypes.CDLL(None, use_errno=True)
+            set_number, get_number = numbers
+            _ioprio_calls = (
+                lambda priority: libc.syscall(set_number, IOPRIO_WHO_PROCESS, 0, priority),
+                lambda: libc.syscall(get_number, IOPRIO_WHO_PROCESS, 0),
+            )
+    return _ioprio_calls or None
+
+
+class GovernedReader:
+    """File wrapper charging every read against an IOGovernor's byte budget."""
+
+    def __init__(self, f, governor):
+        self.f = f
+        self.governor = governor
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.governor.transfer(len(data))
+        return data
+
+
+class IOGovernor:
+    """Token-bucket limits on file operations and bytes per second for bulk file tasks.
+
+    The TaskManager holds one governor shared by all runs (IO_OPS_PER_SECOND,
+    IO_BYTES_PER_SECOND); a task with its own limits gets a governor whose
+    `parent` is the shared one, so both apply. With `idle_priority`, work runs
+    at the idle I/O scheduling class on Linux, so it only gets the disk when
+    nothing else wants it.
+    """
+
+    def __init__(self, ops_per_second=None, bytes_per_second=None, idle_priority=False, parent=None):
+        self.ops = TokenBucket(ops_per_second) if ops_per_second else None
+        self.bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self.idle_priority = idle_priority
+        self.parent = parent
+
+    @property
+    def limited(self):
+        """Whether an ops or bytes budget applies (idle priority alone is not a budget)."""
+        return self.ops is not None or self.bytes is not None or (self.parent is not None and self.parent.limited)
+
+    @property
+    def limits_bytes(self):
+        return self.bytes is not None or (self.parent is not None and self.parent.limits_bytes)
+
+    def op(self, nbytes=0):
+        """Wait for one file operation (and `nbytes` of transfer) to be allowed."""
+        if self.ops is not None:
+            self.ops.acquire()
+        if nbytes and self.bytes is not None:
+            self.bytes.acquire(nbytes)
+        if self.parent is not None:
+            self.parent.op(nbytes)
+
+    def transfer(self, nbytes):
+        """Wait for `nbytes` of transfer to be allowed."""
+        if self.bytes is not None:
+            self.bytes.acquire(nbytes)
+        if self.parent is not None:
+            self.parent.transfer(nbytes)
+
+    def reader(self, f):
+        return GovernedReader(f, self) if self.limits_bytes else f
+
+    @contextmanager
+    def idle(self):
+        """Run the block at idle I/O priority if enabled, restoring the thread's priority afterwards."""
+        calls = ioprio_calls() if self.idle_priority or (self.parent is not None and self.parent.idle_priority) else None
+        previous = calls[1]() if calls else -1
+        if previous < 0:
+            yield
+            return
+        calls[0](IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+        try:
+            yield
+        finally:
+            calls[0](previous)
+
+    def wrap(self, func):
+        """Return `func` made to run at idle I/O priority if enabled, for worker threads."""
+        def run(*args):
+            with self.idle():
+                return func(*args)
+        return run
+
+
+class CircuitBreaker:
+    """Stop calling a failing service until `reset_timeout` seconds have passed."""
+
+    def __init__(self, failure_threshold=1, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Return True if a call may be attempted (closed, or half-open after the timeout)."""
+        if self.opened_at is None:
+            return True
+        return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class LogSpool:
+    """Append-only JSON lines file for log entries that could not be written to MongoDB.
+
+    CLI processes append to the spool while the scheduler replays it, so appends,
+    rotation and the replay's hand-over are serialized by an flock on `path.lock`.
+    Replay first renames the files it takes to `path.replaying-<stamp>-<pid>` and
+    reads them outside the lock, so nothing appended meanwhile is lost.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    @staticmethod
+    def _encode(entries):
+        """Serialize entries as JSON lines, keeping client-assigned _ids as extended JSON.
+
+        Only the scheduler's MongoDB writer assigns _ids, and it already has pymongo
+        loaded; CLI processes spool plain JSON without importing bson.
+        """
+        if any("_id" in entry for entry in entries):
+            from bson import json_util
+
+            return "".join(json_util.dumps(entry, default=str) + "\n" for entry in entries)
+        return "".join(json.dumps(entry, default=str) + "\n" for entry in entries)
+
+    @contextmanager
+    def _locked(self):
+        import fcntl
+
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _rotate(self):
+        """Shift `path` to `path.1`, `path.1` to `path.2`, ... dropping the oldest file."""
+        oldest = f"{self.path}.{self.backup_count}"
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def append(self, entries):
+        """Append entries to the spool, rotating it once it grows past `max_bytes`."""
+        data = self._encode(entries)
+        with self._locked():
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+
+    def _claimed(self):
+        """Spool files already taken by a replay (possibly one that failed or crashed), oldest first."""
+        directory, name = os.path.split(os.path.abspath(self.path))
+        prefix = f"{name}.replaying-"
+        return sorted(os.path.join(directory, entry) for entry in os.listdir(directory) if entry.startswith(prefix))
+
+    def files(self):
+        """Return the spool files that hold entries, oldest first."""
+        paths = [f"{self.path}.{i}" for i in range(self.backup_count, 0, -1)] + [self.path]
+        return self._claimed() + [path for path in paths if os.path.exists(path)]
+
+    def has_entries(self):
+        return bool(self.files())
+
+    def _claim(self):
+        """Rename the rotated and live spool files out of the writers' way, and return every claimed file."""
+        with self._locked():
+            for path in [f"{self.path}.{i}" for i in range(self.backup_count, 0, -1)] + [self.path]:
+                if os.path.exists(path):
+                    os.replace(path, f"{self.path}.replaying-{time.time_ns():020d}-{os.getpid()}")
+        return self._claimed()
+
+    def replay(self, insert_many, batch_size=500):
+        """Send spooled entries through `insert_many`, removing each file once it is fully written.
+
+        `insert_many` returns the entries of a batch that were not written; those go
+        back into the spool, so a partly written batch isn't written twice.
+        """
+        from bson import json_util
+
+        replayed, rejected = 0, []
+        for path in self._claim():
+            with open(path, "r", encoding="utf-8") as f:
+                entries = [json_util.loads(line) for line in f if line.strip()]
+            for start in range(0, len(entries), batch_size):
+                batch = entries[start:start + batch_size]
+                try:
+                    failed = insert_many(batch)
+                except Exception:
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(self._encode(rejected + entries[start:]))
+                    raise
+                rejected.extend(failed)
+                replayed += len(batch) - len(failed)
+            os.remove(path)
+        if rejected:
+            self.append(rejected)
+        return replayed
+
+
+class SpoolLogWriter:
+    """Write log entries straight to the local spool; the scheduler process replays them to MongoDB.
+
+    Entries are appended `batch_size` at a time, so a run takes the spool lock once
+    per batch rather than once per entry; `close` writes what is left.
+    """
+
+    def __init__(self, spool, logger, batch_size=500):
+        self.spool = spool
+        self.logger = logger
+        self.batch_size = batch_size
+        self.spooled_count = 0
+        self.dropped_count = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def write(self, log_entry):
+        with self._lock:
+            self._pending.append(log_entry)
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        entries, self._pending = self._pending, []
+        if not entries:
+            return
+        try:
+            self.spool.append(entries)
+            self.spooled_count += len(entries)
+        except Exception as e:
+            self.dropped_count += len(entries)
+            self.logger.error(f"Error spooling {len(entries)} log entries: {e}")
+
+    def close(self):
+        with self._lock:
+            self._flush()
+
+    def stats(self):
+        return {"spooled": self.spooled_count, "dropped": self.dropped_count}
+
+
+class BufferedLogWriter:
+    """Collect log entries in memory; used by process-pool workers to hand entries back to the scheduler."""
+
+    def __init__(self):
+        self.entries = []
+
+    def write(self, log_entry):
+        self.entries.append(log_entry)
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"buffered": len(self.entries)}
+
+
+class MongoLogWriter:
+    """Buffer log entries in memory and write them to MongoDB in batches from a background thread."""
+
+    def __init__(self, collection, logger, spool, breaker, max_queue_size=10000, batch_size=500, flush_interval=2.0):
+        self.collection = collection
+        self.logger = logger
+        self.spool = spool
+        self.breaker = breaker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.flushed_count = 0
+        self.dropped_count = 0
+        self.spooled_count = 0
+        self._counter_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mongo-log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, log_entry):
+        """Queue a log entry without blocking; drop it if the queue is full."""
+        try:
+            self.queue.put_nowait(log_entry)
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped_count += 1
+
+    def _drain(self, limit):
+        """Take up to `limit` entries from the queue without waiting."""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Flush the queue whenever a batch fills up or the flush interval elapses."""
+        while not self._stop_event.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+            while len(batch) < self.batch_size and not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=min(remaining, 0.1)))
+                except queue.Empty:
+                    continue
+            if batch:
+                self._flush(batch)
+            elif self.breaker.allow() and self.spool.has_entries():
+                self._replay_spool()
+
+    def _insert_many(self, entries):
+        """Insert entries unordered and return the ones MongoDB rejected.
+
+        Each entry gets its _id here, before its first insert, and keeps it through
+        the spool. A BulkWriteError can come after most of the batch is written, so
+        only the documents in its writeErrors are returned; a duplicate key means an
+        earlier attempt (e.g. one cut off by a network error) already stored the
+        document, and counts as written.
+        """
+        from bson import ObjectId
+        from pymongo.errors import BulkWriteError
+
+        for entry in entries:
+            entry.setdefault("_id", ObjectId())
+        failed = []
+        try:
+            self.collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY_ERROR]
+            failed = [entries[error["index"]] for error in errors]
+            if errors:
+                self.logger.error(f"MongoDB wrote {e.details.get('nInserted', 0)} of {len(entries)} log entries; {len(failed)} rejected: {errors[0].get('errmsg')}")
+        with self._counter_lock:
+            self.flushed_count += len(entries) - len(failed)
+        return failed
+
+    def _flush(self, batch):
+        """Write a batch with a single insert_many call, or spool it while MongoDB is unreachable."""
+        if self.breaker.allow():
+            try:
+                failed = self._insert_many(batch)
+                self.breaker.record_success()
+                if failed:
+                    self._spool(failed)
+                elif self.spool.has_entries():
+                    self._replay_spool()
+                return
+            except Exception as e:
+                was_open = self.breaker.is_open
+                self.breaker.record_failure()
+                if not was_open:
+                    self.logger.error(f"MongoDB unreachable, spooling log entries to '{self.spool.path}': {e}")
+        self._spool(batch)
+
+    def _replay_spool(self):
+        """Bulk-write spooled entries once MongoDB is reachable again."""
+        try:
+            replayed = self.spool.replay(self._insert_many, self.batch_size)
+            self.breaker.record_success()
+            self.logger.info(f"Replayed {replayed} spooled log entries to MongoDB.")
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logger.error(f"Error replaying spooled log entries: {e}")
+
+    def _spool(self, batch):
+        try:
+            self.spool.append(batch)
+            with self._counter_lock:
+                self.spooled_count += len(batch)
+        except Exception as e:
+            with self._counter_lock:
+                self.dropped_count += len(batch)
+            self.logger.error(f"Error spooling {len(batch)} log entries: {e}")
+
+    def close(self):
+        """Stop the flusher thread and write out everything still queued."""
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        self._thread.join()
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._flush(batch)
+        self.logger.info(f"MongoDB log writer stopped: {self.flushed_count} flushed, {self.spooled_count} spooled, {self.dropped_count} dropped.")
+
+    def stats(self):
+        """Return the writer's counters."""
+        return {
+            "flushed": self.flushed_count,
+            "spooled": self.spooled_count,
+            "dropped": self.dropped_count,
+            "queued": self.queue.qsize(),
+            "breaker_open": self.breaker.is_open,
+        }
+
+
+def task_details_hash(details):
+    """Return a canonical hash of a task's details, used for duplicate detection."""
+    canonical = json.dumps(details, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class JsonTaskStore:
+    """Task store backed by a single JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load_all(self):
+        """Return all tasks as a {task_name: details} dict."""
+        try:
+            with open(self.path, "r") as f:
+                tasks = json.load(f)
+                return tasks if isinstance(tasks, dict) else {}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_all(self, tasks):
+        """Write all tasks to a temporary file and atomically replace the JSON file."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(tasks, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def get(self, task_name):
+        return self.load_all().get(task_name)
+
+    def add(self, task_type, details):
+        """Store a new task and return its name, or None if an identical task exists."""
+        tasks = self.load_all()
+        if any(existing == details for existing in tasks.values()):
+            return None
+        number = len(tasks) + 1
+        while f"{task_type}_task_{number}" in tasks:
+            number += 1
+        task_name = f"{task_type}_task_{number}"
+        tasks[task_name] = details
+        self._save_all(tasks)
+        return task_name
+
+    def remove(self, task_name):
+        """Delete a task; return False if it does not exist."""
+        tasks = self.load_all()
+        if task_name not in tasks:
+            return False
+        del tasks[task_name]
+        self._save_all(tasks)
+        return True
+
+
+class SqliteTaskStore:
+    """Task store backed by SQLite in WAL mode, with a unique index on the task details hash."""
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS tasks (
+                name TEXT PRIMARY KEY,
+                task_type TEXT NOT NULL,
+                details TEXT NOT NULL,
+                details_hash TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tasks_details_hash ON tasks (details_hash)")
+        self.conn.commit()
+        if json_path:
+            self.migrate_from_json(json_path)
+
+    def migrate_from_json(self, json_path):
+        """Import tasks from a JSON task file into an empty store and rename the file to `.migrated`."""
+        if not os.path.exists(json_path):
+            return 0
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone():
+                return 0
+            tasks = JsonTaskStore(json_path).load_all()
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO tasks (name, task_type, details, details_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (task_name, details.get("task_type", ""), json.dumps(details), task_details_hash(details), time.time())
+                        for task_name, details in tasks.items()
+                    ],
+                )
+        os.replace(json_path, f"{json_path}.migrated")
+        return len(tasks)
+
+    def load_all(self):
+        """Return all tasks as a {task_name: details} dict."""
+        with self._lock:
+            rows = self.conn.execute("SELECT name, details FROM tasks ORDER BY created_at, rowid").fetchall()
+        return {name: json.loads(details) for name, details in rows}
+
+    def get(self, task_name):
+        with self._lock:
+            row = self.conn.execute("SELECT details FROM tasks WHERE name = ?", (task_name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, task_type, details):
+        """Store a new task and return its name, or None if an identical task exists."""
+        details_hash = task_details_hash(details)
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM tasks WHERE details_hash = ?", (details_hash,)).fetchone():
+                return None
+            number = self.conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] + 1
+            while True:
+                task_name = f"{task_type}_task_{number}"
+                try:
+                    with self.conn:
+                        self.conn.execute(
+                            "INSERT INTO tasks (name, task_type, details, details_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+                            (task_name, task_type, json.dumps(details), details_hash, time.time()),
+                        )
+                    return task_name
+                except sqlite3.IntegrityError:
+                    if self.conn.execute("SELECT 1 FROM tasks WHERE details_hash = ?", (details_hash,)).fetchone():
+                        return None
+                    number += 1
+
+    def remove(self, task_name):
+        """Delete a task; return False if it does not exist."""
+        with self._lock, self.conn:
+            return self.conn.execute("DELETE FROM tasks WHERE name = ?", (task_name,)).rowcount > 0
+
+
+class DirectoryWatcher:
+    """Watch a directory (via watchdog/inotify) and pass new files to `callback` in debounced batches."""
+
+    def __init__(self, directory, callback, logger, debounce=2.0, max_delay=30.0):
+        self.directory = os.path.abspath(directory)
+        self.callback = callback
+        self.logger = logger
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.pending = set()
+        self.first_event_at = None
+        self.timer = None
+        self.observer = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start watching; raises ImportError if watchdog is not installed."""
+        from watchdog.observers import Observer
+
+        self.observer = Observer()
+        self.observer.schedule(self, self.directory, recursive=False)
+        self.observer.daemon = True
+        self.observer.start()
+
+    def stop(self):
+        with self._lock:
+            if self.timer is not None:
+                self.timer.cancel()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def dispatch(self, event):
+        """Record files created, written or moved into the watched directory."""
+        if event.is_directory or event.event_type not in ("created", "moved", "closed"):
+            return
+        path = event.dest_path if event.event_type == "moved" else event.src_path
+        path = os.fsdecode(path)
+        if os.path.dirname(os.path.abspath(path)) != self.directory:
+            return
+        with self._lock:
+            self.pending.add(os.path.basename(path))
+            now = time.monotonic()
+            if self.first_event_at is None:
+                self.first_event_at = now
+            # Restart the quiet-period timer, unless the burst has already waited max_delay
+            if self.timer is not None:
+                if now - self.first_event_at >= self.max_delay:
+                    return
+                self.timer.cancel()
+            self.timer = threading.Timer(self.debounce, self._flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush(self):
+        with self._lock:
+            names, self.pending = sorted(self.pending), set()
+            self.first_event_at = None
+            self.timer = None
+        if names:
+            try:
+                self.callback(names)
+            except Exception as e:
+                self.logger.error(f"Error handling file events in '{self.directory}': {e}")
+
+
+class FileStatCache:
+    """Persistent LRU cache of per-file results keyed on (device, inode, size, mtime_ns).
+
+    Results for different purposes share one SQLite table, separated by `kind`.
+    Lookups are done in bulk through a temporary table join; inserts are buffered
+    and written by `flush`, which also evicts the least recently used entries
+    beyond `max_entries`. Last-used times are refreshed at most once per
+    `touch_interval` seconds, so repeated runs don't rewrite every row.
+    """
+
+    def __init__(self, path, max_entries=1000000, touch_interval=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._pending_puts = []
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                kind TEXT NOT NULL,
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (kind, dev, ino, size, mtime_ns)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.conn.execute("CREATE TEMP TABLE lookup (position INTEGER PRIMARY KEY, dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(stat_result):
+        return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+    def get_many(self, kind, stat_results):
+        """Return the cached values for many files (None where a file changed or was never seen)."""
+        values = [None] * len(stat_results)
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM lookup")
+            self.conn.executemany("INSERT INTO lookup VALUES (?, ?, ?, ?, ?)", ((position, *self.key(st)) for position, st in enumerate(stat_results)))
+            rows = self.conn.execute(
+                """SELECT lookup.position, entries.value FROM lookup JOIN entries
+                   ON entries.kind = ? AND entries.dev = lookup.dev AND entries.ino = lookup.ino
+                   AND entries.size = lookup.size AND entries.mtime_ns = lookup.mtime_ns""",
+                (kind,),
+            ).fetchall()
+            self.conn.execute(
+                """UPDATE entries SET last_used = ? WHERE kind = ? AND last_used < ?
+                   AND (dev, ino, size, mtime_ns) IN (SELECT dev, ino, size, mtime_ns FROM lookup)""",
+                (now, kind, now - self.touch_interval),
+            )
+        for position, value in rows:
+            values[position] = value
+        return values
+
+    def put(self, kind, stat_result, value):
+        with self._lock:
+            self._pending_puts.append((kind, *self.key(stat_result), value, time.time()))
+
+    def flush(self):
+        """Write buffered inserts, then evict entries beyond the size cap."""
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO entries (kind, dev, ino, size, mtime_ns, value, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending_puts)
+            self._pending_puts = []
+            excess = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute("DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY last_used LIMIT ?)", (excess,))
+
+
+class ExpiryIndex:
+    """SQLite index of the files delete_files may expire, and of the directories holding them.
+
+    Rows are grouped by scope, a hash of the directory and the walk options. Each
+    file row keeps its mtime, so expired files are a range query; each directory
+    row keeps its mtime_ns, which changes whenever an entry in it is added,
+    removed or renamed, so only those directories need rescanning.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS dirs (
+                scope TEXT NOT NULL,
+                rel_dir TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (scope, rel_dir)
+            )"""
+        )
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                scope TEXT NOT NULL,
+                path TEXT NOT NULL,
+                rel_dir TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                PRIMARY KEY (scope, path)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_expiry ON files (scope, mtime)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_rel_dir ON files (scope, rel_dir)")
+        self.conn.commit()
+
+    @staticmethod
+    def scope(directory, extensions, exclude, prune, max_depth):
+        extensions = None if extensions is None else sorted(extensions)
+        return hashlib.sha1(json.dumps([os.path.abspath(directory), extensions, exclude, prune, max_depth]).encode()).hexdigest()
+
+    def dirs(self, scope):
+        """Return {rel_dir: (depth, mtime_ns)} for the directories indexed under `scope`."""
+        with self._lock:
+            rows = self.conn.execute("SELECT rel_dir, depth, mtime_ns FROM dirs WHERE scope = ?", (scope,)).fetchall()
+        return {rel_dir: (depth, mtime_ns) for rel_dir, depth, mtime_ns in rows}
+
+    def apply(self, scope, scanned, vanished):
+        """Replace the rows of rescanned directories and drop vanished ones with their subtrees.
+
+        `scanned` holds (rel_dir, depth, mtime_ns, files) with files as (path, mtime, size).
+        """
+        with self._lock, self.conn:
+            for rel_dir in vanished:
+                if not rel_dir:
+                    self.conn.execute("DELETE FROM dirs WHERE scope = ?", (scope,))
+                    self.conn.execute("DELETE FROM files WHERE scope = ?", (scope,))
+                    continue
+                prefix = rel_dir + os.sep
+                for table in ("dirs", "files"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE scope = ? AND (rel_dir = ? OR substr(rel_dir, 1, ?) = ?)", (scope, rel_dir, len(prefix), prefix))
+            for rel_dir, depth, mtime_ns, files in scanned:
+                self.conn.execute("INSERT OR REPLACE INTO dirs (scope, rel_dir, depth, mtime_ns) VALUES (?, ?, ?, ?)", (scope, rel_dir, depth, mtime_ns))
+                self.conn.execute("DELETE FROM files WHERE scope = ? AND rel_dir = ?", (scope, rel_dir))
+                self.conn.executemany("INSERT INTO files (scope, path, rel_dir, mtime) VALUES (?, ?, ?, ?)", ((scope, path, rel_dir, mtime) for path, mtime, _ in files))
+
+    def expired(self, scope, cutoff_time):
+        """Return (path, rel_dir) for the indexed files last modified before `cutoff_time`, oldest first."""
+        with self._lock:
+            return self.conn.execute("SELECT path, rel_dir FROM files WHERE scope = ? AND mtime < ? ORDER BY mtime", (scope, cutoff_time)).fetchall()
+
+    def update(self, scope, removed, touched, dir_mtimes=None):
+        """Drop rows of removed files, and store the new mtime of files changed since they were indexed.
+
+        `dir_mtimes` maps directories to the mtime_ns they had right after this run
+        deleted files from them, for those known to have been unchanged until then.
+        """
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM files WHERE scope = ? AND path = ?", ((scope, path) for path in removed))
+            self.conn.executemany("UPDATE dirs SET mtime_ns = ? WHERE scope = ? AND rel_dir = ?", ((mtime_ns, scope, rel_dir) for rel_dir, mtime_ns in (dir_mtimes or {}).items()))
+            self.conn.executemany("UPDATE files SET mtime = ? WHERE scope = ? AND path = ?", ((mtime, scope, path) for path, mtime in touched))
+
+
+class DeletionReport:
+    """Totals for a delete_files run, written as one log record per `batch_size` deletions.
+
+    Each record carries the batch's counts, bytes freed and a sample of paths, so
+    a large cleanup never builds a single document listing every deleted file.
+    """
+
+    def __init__(self, emit, batch_size=1000, sample_size=10):
+        self.emit = emit
+        self.batch_size = batch_size
+        self.sample_size = sample_size
+        self.deleted = 0
+        self.bytes_freed = 0
+        self.errors = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+        self._batch = {"deleted": 0, "bytes_freed": 0, "sample": []}
+
+    def add(self, path, size):
+        with self._lock:
+            self.deleted += 1
+            self.bytes_freed += size
+            self._batch["deleted"] += 1
+            self._batch["bytes_freed"] += size
+            if len(self._batch["sample"]) < self.sample_size:
+                self._batch["sample"].append(path)
+            if self._batch["deleted"] >= self.batch_size:
+                self._emit_batch()
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def flush(self):
+        with self._lock:
+            if self._batch["deleted"]:
+                self._emit_batch()
+
+    def _emit_batch(self):
+        self.batches += 1
+        self.emit({"batch": self.batches, **self._batch})
+        self._batch = {"deleted": 0, "bytes_freed": 0, "sample": []}
+
+
+def _fsync_directory(path):
+    """Flush a directory entry change (a created or renamed file) to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class OrganizeJournal:
+    """Append-only JSON lines journal of an organize plan and its progress.
+
+    The first line is a header, followed by one [src, dst, category] line per
+    planned move, all fsynced before anything is moved. Progress is appended as
+    {"done": [...]} / {"undone": [...]} checkpoint lines of move indexes, fsynced
+    in batches. The file name carries the run state: `<run_id>.pending.jsonl`
+    until the run finishes, then `.complete.jsonl` or `.undone.jsonl`. The run
+    holding a journal keeps an exclusive flock on it, so a journal still being
+    executed is never resumed or undone by another run.
+    """
+
+    def __init__(self, path, header, moves, done=(), undone=(), resumed=False, sync_every=1000, sync_interval=1.0, file=None):
+        self.path = path
+        self.header = header
+        self.moves = moves
+        self.done = set(done)
+        self.undone = set(undone)
+        self.resumed = resumed
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._checkpoints = {"done": [], "undone": []}
+        self._last_sync = time.monotonic()
+        self._file = file or self._open_locked(path)
+
+    @property
+    def run_id(self):
+        return self.header["run_id"]
+
+    @property
+    def state(self):
+        return self.path.rsplit(".", 2)[-2]
+
+    @staticmethod
+    def _open_locked(path):
+        """Open a journal for appending under an exclusive flock; return None if another run holds it."""
+        import fcntl
+
+        f = open(path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    @staticmethod
+    def read_header(path):
+        with open(path, "rb") as f:
+            return json.loads(f.readline())
+
+    @staticmethod
+    def directory_key(directory):
+        return hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()[:12]
+
+    @classmethod
+    def create(cls, journal_dir, task_name, directory, plan):
+        """Write `plan` to a new pending journal and return it."""
+        os.makedirs(journal_dir, exist_ok=True)
+        run_id = f"{task_name}-{datetime.now():%Y%m%dT%H%M%S%f}-{cls.directory_key(directory)}"
+        header = {"run_id": run_id, "task": task_name, "directory": os.path.abspath(directory), "created": time.strftime("%Y-%m-%d %H:%M:%S"), "moves": len(plan)}
+        path = os.path.join(journal_dir, f"{run_id}.pending.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            f.writelines(json.dumps(move) + "\n" for move in plan)
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_directory(journal_dir)
+        return cls(path, header, plan)
+
+    @classmethod
+    def load(cls, path):
+        """Read a journal back, dropping a final line torn by a crash; None if another run holds it."""
+        file = cls._open_locked(path)
+        if file is None:
+            return None
+        moves, done, undone = [], set(), set()
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            offset = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line)
+                if isinstance(record, list):
+                    moves.append(tuple(record))
+                else:
+                    done.update(record.get("done", ()))
+                    undone.update(record.get("undone", ()))
+                offset += len(line)
+        if offset < os.path.getsize(path):
+            os.truncate(path, offset)
+        return cls(path, header, moves, done, undone, resumed=True, file=file)
+
+    @staticmethod
+    def find(journal_dir, task_name=None, directory=None, states=JOURNAL_STATES):
+        """Return the paths of the journals matching the filters, oldest first."""
+        try:
+            names = os.listdir(journal_dir)
+        except FileNotFoundError:
+            return []
+        key = directory and OrganizeJournal.directory_key(directory)
+        found = []
+        for name in names:
+            parts = name.split(".")
+            if len(parts) != 3 or parts[2] != "jsonl" or parts[1] not in states or parts[0].count("-") < 2:
+                continue
+            run_task, run_time, run_key = parts[0].rsplit("-", 2)
+            if (task_name and run_task != task_name) or (key and run_key != key):
+                continue
+            found.append((run_time, os.path.join(journal_dir, name)))
+        return [path for _, path in sorted(found)]
+
+    @staticmethod
+    def prune(journal_dir, keep):
+        """Delete the oldest finished journals beyond the newest `keep`."""
+        finished = OrganizeJournal.find(journal_dir, states=("complete", "undone"))
+        for path in finished[:max(len(finished) - keep, 0)]:
+            os.remove(path)
+
+    def mark(self, kind, indexes):
+        """Record the moves `indexes` as "done" or "undone"."""
+        with self._lock:
+            getattr(self, kind).update(indexes)
+            self._checkpoints[kind].extend(indexes)
+            if len(self._checkpoints[kind]) >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        lines = [json.dumps({kind: indexes}) + "\n" for kind, indexes in self._checkpoints.items() if indexes]
+        if lines:
+            self._file.writelines(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._checkpoints = {"done": [], "undone": []}
+        self._last_sync = time.monotonic()
+
+    def finish(self, state):
+        """Write the last checkpoint and rename the journal to its final state."""
+        with self._lock:
+            self._checkpoint()
+        # Rename while still holding the lock, so no other run can pick up the pending name
+        path = f"{self.path.rsplit('.', 2)[0]}.{state}.jsonl"
+        os.replace(self.path, path)
+        _fsync_directory(os.path.dirname(path) or ".")
+        self.path = path
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._checkpoint()
+            self._file.close()
+
+
+class MessageTemplate:
+    """A send_email subject or body compiled into literal text and {column|default} fields.
+
+    A field takes the row's value for its column, or its default (empty if none is
+    given) where the column is missing or the value is empty. `render` fills in a
+    whole chunk of rows at once, one array operation per part of the template.
+    Fields written without a default are `required`: see `unmatched_fields`.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.parts = []
+        self.required = set()
+        literal = []
+        position = 0
+        for match in TEMPLATE_TOKENS.finditer(source):
+            literal.append(source[position:match.start()])
+            position = match.end()
+            if match.group(1) is None:
+                literal.append(match.group()[0])
+                continue
+            self.parts.append(("".join(literal), None))
+            literal = []
+            self.parts.append((match.group(1), match.group(2) or ""))
+            if match.group(2) is None:
+                self.required.add(match.group(1))
+        literal.append(source[position:])
+        self.parts.append(("".join(literal), None))
+        self.fields = {part for part, default in self.parts if default is not None}
+
+    def unmatched_fields(self, columns):
+        """Return the fields without a default that name none of `columns`, and so render empty for every row."""
+        return sorted(self.required - set(columns))
+
+    def render(self, frame):
+        """Return the template rendered for every row of a DataFrame of string columns."""
+        import numpy as np
+
+        rendered = np.full(len(frame), "", dtype=object)
+        for part, default in self.parts:
+            if default is None:
+                if part:
+                    rendered = rendered + part
+            elif part in frame:
+                values = frame[part].to_numpy(dtype=object, na_value="")
+                rendered = rendered + np.where(values == "", default, values)
+            elif default:
+                rendered = rendered + default
+        return rendered.tolist()
+
+
+class EmailOutbox:
+    """SQLite outbox of CSV/XLSX campaigns, holding each recipient's delivery state.
+
+    A recipient row is queued once per campaign and moves from pending to sent, or
+    to retry (with a retry_at time) after a transient failure, and to failed once
+    its attempts run out or the server rejects it outright. Every result is
+    committed as it happens, so a campaign that is run again, after a crash or on
+    its next interval, only sends to the recipients still pending or due a retry.
+    """
+
+    def __init__(self, path, max_attempts=5, retry_base=30.0, retry_max=900.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._lock = threading.Lock()
+        # campaign_id -> the integer key its outbox rows are stored under
+        self._keys = {}
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS campaigns (
+                id INTEGER PRIMARY KEY,
+                campaign_id TEXT NOT NULL UNIQUE,
+                email_list TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                created REAL NOT NULL,
+                completed REAL
+            )"""
+        )
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS outbox (
+                campaign INTEGER NOT NULL,
+                recipient TEXT NOT NULL,
+                fields TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                retry_at REAL,
+                updated REAL,
+                UNIQUE (campaign, recipient)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_state ON outbox (campaign, state)")
+        self.conn.commit()
+
+    @staticmethod
+    def campaign_id(email_list, subject, template, attachments):
+        """Default campaign id: the same list, subject, message and attachments make the same campaign.
+
+        Attachments count by path, size and modification time, so replacing an
+        attachment's contents starts a new campaign.
+        """
+        files = []
+        for path in sorted(attachments or []):
+            try:
+                stat = os.stat(path)
+                files.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                files.append([os.path.abspath(path), None, None])
+        return hashlib.sha1(json.dumps([os.path.abspath(email_list), subject, template, files]).encode()).hexdigest()
+
+    @staticmethod
+    def idempotency_key(campaign_id, recipient):
+        """Key identifying one campaign's message to one recipient, the same on every attempt and every run."""
+        return hashlib.sha256(f"{campaign_id}\0{recipient}".encode()).hexdigest()[:32]
+
+    def open_campaign(self, campaign_id, email_list, subject):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO campaigns (campaign_id, email_list, subject, created) VALUES (?, ?, ?, ?)", (campaign_id, email_list, subject, time.time()))
+            self._keys[campaign_id] = self.conn.execute("SELECT id FROM campaigns WHERE campaign_id = ?", (campaign_id,)).fetchone()[0]
+
+    def add(self, campaign_id, chunk):
+        """Queue a chunk of recipient rows (see TaskManager._recipient_chunks); return how many were new."""
+        key = self._keys[campaign_id]
+        # One JSON object per row, serialized by pandas rather than row by row
+        fields = chunk.to_json(orient="records", lines=True).splitlines()
+        with self._lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO outbox (campaign, recipient, fields) VALUES (?, ?, ?)", zip(itertools.repeat(key), chunk["email"], fields))
+            added = self.conn.total_changes - before
+            if added:
+                self.conn.execute("UPDATE campaigns SET completed = NULL WHERE id = ?", (key,))
+        return added
+
+    def due(self, campaign_id, now, page_size=500):
+        """Yield lists of (recipient, fields, idempotency_key) for pending rows, then retries due by `now`, a page at a time."""
+        key = self._keys[campaign_id]
+        for state, condition in (("pending", ""), ("retry", " AND retry_at <= ?")):
+            last_rowid = 0
+            while True:
+                params = (key, state, last_rowid) + ((now,) if condition else ()) + (page_size,)
+                with self._lock:
+                    rows = self.conn.execute(
+                        f"SELECT rowid, recipient, fields FROM outbox WHERE campaign = ? AND state = ? AND rowid > ?{condition} ORDER BY rowid LIMIT ?",
+                        params,
+                    ).fetchall()
+                if rows:
+                    last_rowid = rows[-1][0]
+                    yield [(recipient, json.loads(fields), self.idempotency_key(campaign_id, recipient)) for _, recipient, fields in rows]
+                if len(rows) < page_size:
+                    break
+
+    def record(self, campaign_id, recipient, error=None, retryable=True):
+        """Store the result of one delivery attempt and return the recipient's new state.
+
+        A failed attempt is retried after an exponentially growing delay, half of it
+        random jitter, unless it is not `retryable` or was the last one allowed.
+        """
+        key = self._keys[campaign_id]
+        now = time.time()
+        with self._lock, self.conn:
+            if error is None:
+                self.conn.execute("UPDATE outbox SET state = 'sent', attempts = attempts + 1, retry_at = NULL, updated = ? WHERE campaign = ? AND recipient = ?", (now, key, recipient))
+                return "sent"
+            attempts = self.conn.execute("SELECT attempts FROM outbox WHERE campaign = ? AND recipient = ?", (key, recipient)).fetchone()[0] + 1
+            if retryable and attempts < self.max_attempts:
+                delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+                state, retry_at = "retry", now + delay / 2 + random.uniform(0, delay / 2)
+            else:
+                state, retry_at = "failed", None
+            self.conn.execute("UPDATE outbox SET state = ?, attempts = ?, retry_at = ?, updated = ? WHERE campaign = ? AND recipient = ?", (state, attempts, retry_at, now, key, recipient))
+            return state
+
+    def next_retry(self, campaign_id):
+        """Time of the campaign's earliest scheduled retry, or None if none is left."""
+        with self._lock:
+            return self.conn.execute("SELECT MIN(retry_at) FROM outbox WHERE campaign = ? AND state = 'retry'", (self._keys[campaign_id],)).fetchone()[0]
+
+    def totals(self, campaign_id):
+        """Return a Counter of the campaign's recipients by state."""
+        with self._lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM outbox WHERE campaign = ? GROUP BY state", (self._keys[campaign_id],)).fetchall()
+        return Counter(dict(rows))
+
+    def finish(self, campaign_id):
+        """Mark the campaign completed once no recipient is pending or waiting for a retry."""
+        key = self._keys[campaign_id]
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE campaigns SET completed = ? WHERE id = ? AND NOT EXISTS (SELECT 1 FROM outbox WHERE campaign = ? AND state IN ('pending', 'retry'))",
+                (time.time(), key, key),
+            )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class EncodedAttachment:
+    """An attachment's MIME part (headers and base64 body, CRLF line endings), encoded once per run.
+
+    The file is read and encoded in chunks. The encoded part stays in memory up
+    to `memory_limit` bytes, and larger ones are written to a temporary file and
+    streamed from it with positional reads, which are safe to share between
+    sender threads.
+    """
+
+    def __init__(self, path, memory_limit=ATTACHMENT_MEMORY_LIMIT):
+        import base64
+        import tempfile
+        from email import policy
+        from email.mime.base import MIMEBase
+
+        part = MIMEBase("application", "octet-stream")
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", f"attachment; filename={os.path.basename(path)}")
+        self.path = path
+        self.data = part.as_bytes(policy=policy.compat32.clone(linesep="\r\n"))
+        self.size = len(self.data)
+        self._file = None
+        with open(path, "rb") as f:
+            encoded = []
+            for chunk in iter(lambda: f.read(ATTACHMENT_READ_SIZE), b""):
+                encoded.append(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+                self.size += len(encoded[-1])
+                if self._file is None and self.size > memory_limit:
+                    self._file = tempfile.TemporaryFile()
+                    self._file.write(self.data)
+                    self.data = None
+                if self._file is not None:
+                    self._file.writelines(encoded)
+                    encoded = []
+            if self._file is None:
+                self.data += b"".join(encoded)
+            else:
+                self._file.flush()
+
+    def chunks(self):
+        if self._file is None:
+            yield self.data
+            return
+        for offset in range(0, self.size, ATTACHMENT_READ_SIZE):
+            yield os.pread(self._file.fileno(), ATTACHMENT_READ_SIZE, offset)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class OutgoingMessage:
+    """A multipart message: per-recipient headers and text part, followed by shared encoded attachments."""
+
+    def __init__(self, head, boundary, attachments):
+        self.head = head
+        self.boundary = boundary
+        self.attachments = attachments
+
+    def chunks(self):
+        """Yield the message as it goes on the wire in the DATA phase (dot-stuffed, CRLF line endings)."""
+        yield self.head
+        for attachment in self.attachments:
+            yield b"--" + self.boundary + b"\r\n"
+            yield from attachment.chunks()
+        yield b"--" + self.boundary + b"--\r\n"
+
+
+class SMTPSession:
+    """An authenticated SMTP connection with the bookkeeping SMTPPool needs to retire it."""
+
+    def __init__(self, server):
+        self.server = server
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+
+
+class SMTPPool:
+    """Authenticated SMTP sessions kept open and reused across messages.
+
+    A sender checks a session out for each message and returns it afterwards. A
+    session is retired after `max_messages` messages, when it has been idle for
+    more than `idle_timeout` seconds, or after any SMTP error (a 4xx/5xx reply or a
+    dropped connection); a message that failed with a transient error (4xx or a
+    disconnect) is retried once on a fresh session. At most `max_idle` sessions
+    are kept open between messages.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, max_messages=100, idle_timeout=30.0, max_idle=8, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+
+    def _connect(self):
+        import smtplib
+
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            # Messages are streamed in several writes; don't let Nagle hold the last one back for the server's delayed ACK
+            server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.starttls:
+                server.starttls()
+            if self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        with self._lock:
+            self.connections_opened += 1
+        return SMTPSession(server)
+
+    def _checkout(self):
+        """Return an idle session that is still fresh, or a new one."""
+        stale = []
+        session = None
+        with self._lock:
+            now = time.monotonic()
+            while self._idle:
+                candidate = self._idle.pop()
+                if now - candidate.last_used <= self.idle_timeout:
+                    session = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        return session or self._connect()
+
+    def _checkin(self, session):
+        session.last_used = time.monotonic()
+        if session.messages_sent < self.max_messages:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(session)
+                    return
+        session.close()
+
+    @staticmethod
+    def _is_transient(error):
+        import smtplib
+
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(400 <= code < 500 for code, _ in error.recipients.values())
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+    @staticmethod
+    def _send_message(server, from_addr, to_addr, message):
+        """MAIL, RCPT and DATA for one OutgoingMessage, streaming its chunks instead of building one string."""
+        import smtplib
+
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(from_addr)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, from_addr)
+        code, response = server.rcpt(to_addr)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({to_addr: (code, response)})
+        code, response = server.docmd("data")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+        for chunk in message.chunks():
+            server.send(chunk)
+        server.send(b".\r\n")
+        code, response = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def send(self, from_addr, to_addr, message):
+        """Send one OutgoingMessage on a pooled session; the session is replaced on errors."""
+        for attempt in range(2):
+            session = self._checkout()
+            try:
+                self._send_message(session.server, from_addr, to_addr, message)
+            except Exception as e:
+                session.close()
+                if attempt or not self._is_transient(e):
+                    raise
+                continue
+            session.messages_sent += 1
+            self._checkin(session)
+            return
+
+    def close(self):
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            session.close()
+
+
+class AsyncSMTPEngine:
+    """SMTP delivery from one asyncio event loop, with many sessions open at once.
+
+    `send_all` runs up to `connections` sessions as coroutines taking messages from
+    a shared queue, each delivering one message at a time; a session is replaced
+    after `max_messages` messages or any SMTP error, and a message that failed with
+    a transient error is retried once on a fresh session, as in SMTPPool. Where the
+    server offers PIPELINING, a message's MAIL, RCPT and DATA commands go out in one
+    write, so each message takes two round trips instead of four. Connecting and
+    delivering a message are each cancelled after `timeout` seconds.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, max_messages=100, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.local_hostname = socket.getfqdn()
+        self.connections_opened = 0
+
+    @staticmethod
+    async def _reply(reader):
+        """Read one (possibly multiline) reply and return (code, text)."""
+        import smtplib
+
+        lines = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b"-":
+                return int(line[:3]), b"\n".join(lines)
+
+    async def _command(self, reader, writer, command):
+        writer.write(command + b"\r\n")
+        await writer.drain()
+        return await self._reply(reader)
+
+    async def _ehlo(self, reader, writer):
+        """Greet the server and return the extensions it offers."""
+        import smtplib
+
+        code, text = await self._command(reader, writer, f"EHLO {self.local_hostname}".encode())
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, text)
+        return {line.split(b" ")[0].upper().decode() for line in text.split(b"\n")[1:] if line}
+
+    async def _open(self):
+        """Connect, STARTTLS and log in; return the session as (reader, writer, pipelining)."""
+        import asyncio
+        import ssl
+        import base64
+        import smtplib
+
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            code, text = await self._reply(reader)
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, text)
+            extensions = await self._ehlo(reader, writer)
+            if self.starttls:
+                code, text = await self._command(reader, writer, b"STARTTLS")
+                if code != 220:
+                    raise smtplib.SMTPResponseException(code, text)
+                await writer.start_tls(ssl.create_default_context(), server_hostname=self.host)
+                extensions = await self._ehlo(reader, writer)
+            if self.password:
+                token = base64.b64encode(f"\0{self.username}\0{self.password}".encode()).decode()
+                code, text = await self._command(reader, writer, f"AUTH PLAIN {token}".encode())
+                if code != 235:
+                    raise smtplib.SMTPAuthenticationError(code, text)
+        except BaseException:
+            writer.close()
+            raise
+        self.connections_opened += 1
+        return reader, writer, "PIPELINING" in extensions
+
+    async def _deliver(self, session, from_addr, to_addr, message):
+        """MAIL, RCPT and DATA for one OutgoingMessage, raising the smtplib exception SMTPPool would."""
+        import smtplib
+
+        reader, writer, pipelining = session
+        envelope = [f"MAIL FROM:<{from_addr}>".encode(), f"RCPT TO:<{to_addr}>".encode(), b"DATA"]
+        if pipelining:
+            writer.write(b"".join(command + b"\r\n" for command in envelope))
+            await writer.drain()
+            replies = [await self._reply(reader) for _ in envelope]
+        else:
+            replies = []
+            for command in envelope:
+                replies.append(await self._command(reader, writer, command))
+                if replies[-1][0] >= 400:
+                    break
+        (code, text), *replies = replies
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, text, from_addr)
+        (code, text), *replies = replies
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({to_addr: (code, text)})
+        code, text = replies[0]
+        if code != 354:
+            raise smtplib.SMTPDataError(code, text)
+        for chunk in message.chunks():
+            writer.write(chunk)
+            await writer.drain()
+        writer.write(b".\r\n")
+        await writer.drain()
+        code, text = await self._reply(reader)
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+
+    async def _quit(self, session):
+        import asyncio
+
+        reader, writer, _ = session
+        try:
+            await asyncio.wait_for(self._command(reader, writer, b"QUIT"), 1)
+        except Exception:
+            pass
+        writer.close()
+
+    async def _worker(self, from_addr, pending, bucket, done):
+        import asyncio
+
+        session = None
+        messages_sent = 0
+        try:
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                to_addr, message, context = item
+                delay = bucket.reserve() if bucket is not None else 0
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                error = None
+                for attempt in range(2):
+                    try:
+                        if session is None:
+                            session = await asyncio.wait_for(self._open(), self.timeout)
+                            messages_sent = 0
+                        await asyncio.wait_for(self._deliver(session, from_addr, to_addr, message), self.timeout)
+                        error = None
+                        break
+                    except Exception as e:
+                        error = e
+                        if session is not None:
+                            session[1].close()
+                            session = None
+                        if attempt or not SMTPPool._is_transient(e):
+                            break
+                if error is None:
+                    messages_sent += 1
+                    if messages_sent >= self.max_messages:
+                        await self._quit(session)
+                        session = None
+                done(to_addr, error, delay > 0, context)
+        finally:
+            if session is not None:
+                await self._quit(session)
+
+    async def send_all(self, from_addr, messages, connections, bucket, done):
+        """Send (to_addr, OutgoingMessage, context) items from an iterable over up to `connections` sessions.
+
+        `bucket` (a TokenBucket or None) paces the sends; each result goes to
+        `done(to_addr, error, throttled, context)`, with error None once delivered.
+        Producing messages and recording results may block (rendering, database
+        commits), so `messages` is iterated on a worker thread and `done` is called
+        on another, in order, keeping the event loop free for the sessions. If `done`
+        raises, no further messages are taken and the error is raised at the end.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue(maxsize=connections * 4)
+        stopped = asyncio.Event()
+        errors = []
+        results = ThreadPoolExecutor(1, thread_name_prefix="smtp-results")
+
+        def record(*result):
+            try:
+                done(*result)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [asyncio.create_task(self._worker(from_addr, pending, bucket, lambda *result: results.submit(record, *result))) for _ in range(connections)]
+
+        def worker_done(_):
+            if all(worker.done() for worker in workers):
+                stopped.set()
+
+        for worker in workers:
+            worker.add_done_callback(worker_done)
+
+        async def put(item):
+            # Waiting on the queue alone would hang once every session has stopped
+            if not pending.full():
+                pending.put_nowait(item)
+                return
+            putting, stopping = asyncio.ensure_future(pending.put(item)), asyncio.ensure_future(stopped.wait())
+            await asyncio.wait([putting, stopping], return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if not putting.done():
+                putting.cancel()
+                raise RuntimeError("Every SMTP session has stopped")
+
+        async def put_all(items):
+            for item in items:
+                await put(item)
+
+        def produce():
+            # Items cross to the loop a queue's worth at a time, not one call per message
+            iterator = iter(messages)
+            for items in iter(lambda: list(itertools.islice(iterator, pending.maxsize)), []):
+                if errors:
+                    break
+                asyncio.run_coroutine_threadsafe(put_all(items), loop).result()
+
+        try:
+            await loop.run_in_executor(None, produce)
+        finally:
+            try:
+                for _ in workers:
+                    await put(None)
+            except RuntimeError:
+                pass
+            await asyncio.gather(*workers)
+            await asyncio.to_thread(results.shutdown)
+        if errors:
+            raise errors[0]
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    """Serve one JSON request per connection on the scheduler's control socket."""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.manager.handle_control_request(request)
+        except Exception as e:
+            response = {"ok": False, "message": f"Error: {e}"}
+        self.wfile.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+
+
+def send_control_request(socket_path, request, timeout=30):
+    """Send a request to a running scheduler; return None if no scheduler is listening."""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                return json.loads(f.readline())
+    except (ConnectionRefusedError, FileNotFoundError):
+        return None
+
+
+_process_manager = None
+
+
+def _ignore_sigint():
+    """Leave Ctrl+C handling to the scheduler process, which shuts the pool workers down."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_task_in_process(method_name, args, kwargs=None):
+    """Run a TaskManager method in a process-pool worker and return its log entries to the scheduler."""
+    global _process_manager
+    if _process_manager is None:
+        _process_manager = TaskManager(start_services=False)
+    _process_manager.log_writer = BufferedLogWriter()
+    getattr(_process_manager, method_name)(*args, **(kwargs or {}))
+    return {"log_entries": _process_manager.log_writer.entries}
+
+
+class TaskManager:
+    # ... (rest of the TaskManager class code is the same as before) ...
+    def __init__(self, start_services=True):
+        """Initialize TaskManager with logging, MongoDB, and scheduler.
+
+        With `start_services=False` no MongoDB client or scheduler is created: log
+        entries go to the local spool and tasks are only read from or written to
+        the task store. This is the path used by the list/add/remove commands.
+        """
+        # Logging Configuration
+        logging.basicConfig(
+            filename="task_manager.log",
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s"
+        )
+        self.logger = logging.getLogger(__name__)
+
+        # MongoDB Configuration
+        self.mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+        self.mongo_timeout_ms = int(os.getenv("MONGO_TIMEOUT_MS", "2000"))
+        self.log_flush_interval = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))
+        self.log_batch_size = int(os.getenv("LOG_BATCH_SIZE", "500"))
+        self.log_queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+        self.log_spool = LogSpool(
+            os.getenv("LOG_SPOOL_FILE", "log_spool.jsonl"),
+            max_bytes=int(os.getenv("LOG_SPOOL_MAX_BYTES", str(10 * 1024 * 1024))),
+            backup_count=int(os.getenv("LOG_SPOOL_BACKUPS", "5")),
+        )
+        self.start_services = start_services
+        if start_services:
+            from pymongo import MongoClient
+
+            self.client = MongoClient(
+                self.mongo_uri,
+                serverSelectionTimeoutMS=self.mongo_timeout_ms,
+                connectTimeoutMS=self.mongo_timeout_ms,
+                socketTimeoutMS=self.mongo_timeout_ms,
+            )
+            self.db = self.client["task_manager_db"]
+            self.logs_collection = self.db["logs"]
+            self.mongo_breaker = CircuitBreaker(reset_timeout=float(os.getenv("MONGO_RETRY_INTERVAL", "30")))
+            self.log_writer = MongoLogWriter(
+                self.logs_collection,
+                self.logger,
+                self.log_spool,
+                self.mongo_breaker,
+                max_queue_size=self.log_queue_size,
+                batch_size=self.log_batch_size,
+                flush_interval=self.log_flush_interval,
+            )
+        else:
+            self.log_writer = SpoolLogWriter(self.log_spool, self.logger, batch_size=self.log_batch_size)
+        atexit.register(self.log_writer.close)
+
+        # Scheduler Configuration
+        self.control_socket = os.getenv("CONTROL_SOCKET", DEFAULT_CONTROL_SOCKET)
+        self.control_server = None
+        self.watchers = {}
+        self.scheduler = None
+        self.executor_routes = dict(EXECUTOR_ROUTES)
+        for route in filter(None, os.getenv("EXECUTOR_ROUTES", "").split(",")):
+            task_type, _, executor = route.partition("=")
+            self.executor_routes[task_type.strip()] = executor.strip()
+        self.job_defaults = {
+            "max_instances": int(os.getenv("JOB_MAX_INSTANCES", "1")),
+            "coalesce": os.getenv("JOB_COALESCE", "true").lower() == "true",
+            "misfire_grace_time": int(os.getenv("JOB_MISFIRE_GRACE_TIME", "60")),
+        }
+        if start_services:
+            from apscheduler.schedulers.background import BackgroundScheduler
+            from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
+            from apscheduler.events import EVENT_JOB_EXECUTED
+
+            executors = {"default": ThreadPoolExecutor(10)}
+            for name, (kind, size) in EXECUTOR_POOLS.items():
+                if kind == "process":
+                    executors[name] = ProcessPoolExecutor(size, pool_kwargs={"initializer": _ignore_sigint})
+                else:
+                    executors[name] = ThreadPoolExecutor(size)
+            self.scheduler = BackgroundScheduler(executors=executors, job_defaults=self.job_defaults)
+            self.scheduler.add_listener(self._on_job_executed, EVENT_JOB_EXECUTED)
+
+        # Task Storage: SQLite by default; an existing JSON task file is migrated on first use
+        self.tasks_file = "scheduled_tasks.json"
+        if os.getenv("TASK_STORE", "sqlite") == "json":
+            self.task_store = JsonTaskStore(self.tasks_file)
+        else:
+            self.task_store = SqliteTaskStore(os.getenv("TASK_STORE_PATH", "scheduled_tasks.db"), json_path=self.tasks_file)
+
+        # File Types for Organization
+        self.file_types = {
+            "Images": [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".svg"],
+            "Videos": [".mp4", ".mkv", ".flv", ".mov", ".avi", ".wmv"],
+            "Documents": [".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".txt"],
+            "Audio": [".mp3", ".wav", ".aac", ".flac", ".ogg"],
+            "Archives": [".zip", ".rar", ".tar", ".gz", ".7z"],
+            "Executables": [".exe", ".msi", ".bat", ".sh"],
+            "Code": [".py", ".js", ".html", ".css", ".java", ".cpp", ".c", ".php"],
+            "Data": [".csv", ".json", ".xml", ".sql", ".db"],
+        }
+        # Extension -> category lookup built once from file_types
+        self.extension_index = {ext: category for category, extensions in self.file_types.items() for ext in extensions}
+        self.file_cache_path = os.getenv("FILE_CACHE_PATH", "file_cache.db")
+        self.file_cache_max_entries = int(os.getenv("FILE_CACHE_MAX_ENTRIES", "1000000"))
+        self._file_cache = None
+        self.expiry_index_path = os.getenv("EXPIRY_INDEX_PATH", "expiry_index.db")
+        self._expiry_index = None
+        self.email_outbox_path = os.getenv("EMAIL_OUTBOX_PATH", "email_outbox.db")
+        self._email_outbox = None
+        self.smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
+        self._smtp_pool = None
+        self.io_governor = IOGovernor(
+            float(os.getenv("IO_OPS_PER_SECOND", "0")),
+            parse_size(os.getenv("IO_BYTES_PER_SECOND", "0")),
+            os.getenv("IO_IDLE_PRIORITY", "false").lower() == "true",
+        )
+        # Compiled send_email templates: file path -> (mtime_ns, size, MessageTemplate)
+        self._templates = {}
+        # Campaigns being sent by this process, so a retry run and an interval run don't mail the same rows
+        self._email_campaigns = set()
+        self._email_campaigns_lock = threading.Lock()
+        self.journal_dir = os.getenv("ORGANIZE_JOURNAL_DIR", "organize_journals")
+        self.journal_keep = int(os.getenv("ORGANIZE_JOURNAL_KEEP", "20"))
+
+        # Load and schedule existing tasks
+        if self.scheduler is not None:
+            self.load_and_schedule_tasks()
+
+    def log_to_mongodb(self, task_name, details, status, level="INFO"):
+        """Queue a log entry for the background MongoDB writer."""
+        log_entry = {
+            "task_name": task_name,
+            "details": details,
+            "status": status,
+            "level": level,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        self.log_writer.write(log_entry)
+
+    def load_tasks(self):
+        """Load all tasks from the task store."""
+        return self.task_store.load_all()
+
+    def classify_file(self, filename):
+        """Return the category folder for a file name, based on its extension."""
+        return self.extension_index.get(os.path.splitext(filename)[1].lower(), "Others")
+
+    @property
+    def file_cache(self):
+        """Persistent per-file result cache, opened on first use."""
+        if self._file_cache is None:
+            self._file_cache = FileStatCache(self.file_cache_path, self.file_cache_max_entries)
+        return self._file_cache
+
+    @property
+    def expiry_index(self):
+        """Persistent delete_files expiry index, opened on first use."""
+        if self._expiry_index is None:
+            self._expiry_index = ExpiryIndex(self.expiry_index_path)
+        return self._expiry_index
+
+    @property
+    def email_outbox(self):
+        """Persistent send_email campaign outbox, opened on first use."""
+        if self._email_outbox is None:
+            self._email_outbox = EmailOutbox(
+                self.email_outbox_path,
+                int(os.getenv("EMAIL_MAX_ATTEMPTS", "5")),
+                float(os.getenv("EMAIL_RETRY_BASE", "30")),
+                float(os.getenv("EMAIL_RETRY_MAX", "900")),
+            )
+        return self._email_outbox
+
+    @property
+    def smtp_pool(self):
+        """Pool of SMTP sessions for SMTP_HOST:SMTP_PORT, opened on first use."""
+        if self._smtp_pool is None:
+            self._smtp_pool = SMTPPool(
+                self.smtp_host,
+                self.smtp_port,
+                os.getenv("SENDER_EMAIL"),
+                os.getenv("SENDER_PASSWORD"),
+                starttls=os.getenv("SMTP_STARTTLS", "true").lower() == "true",
+                max_messages=int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100")),
+                idle_timeout=float(os.getenv("SMTP_IDLE_TIMEOUT", "30")),
+                timeout=float(os.getenv("SMTP_TIMEOUT", "30")),
+            )
+        return self._smtp_pool
+
+    def _io_governor(self, io_ops=None, io_bytes=None, io_idle=None):
+        """Return the governor for a run: the shared one, with any per-task limits layered on top."""
+        if io_ops is None and io_bytes is None and io_idle is None:
+            return self.io_governor
+        return IOGovernor(io_ops, None if io_bytes is None else parse_size(io_bytes), bool(io_idle), parent=self.io_governor)
+
+    @staticmethod
+    def sniff_kind(path):
+        """Return the extension or category of the first MAGIC_SIGNATURES entry matching a file's leading bytes, or None."""
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_BYTES)
+        for offset, magic, kind in MAGIC_SIGNATURES:
+            if head.startswith(magic, offset):
+                return kind
+        return None
+
+    def sniff_category(self, path):
+        """Return the category for a file's leading magic bytes, or None if no signature matches."""
+        kind = self.sniff_kind(path)
+        return None if kind is None else self.extension_index.get(kind, kind)
+
+    def _classify_files(self, directory, files, sniff=None, governor=None):
+        """Classify (relative dir, name) pairs by extension, sniffing content when `sniff` is set.
+
+        `sniff="unknown"` sniffs only files whose extension is not recognised;
+        `sniff="all"` sniffs every file, but a container signature (see
+        CONTAINER_SIGNATURES) never overrides a known extension. Sniffed results are cached on (device, inode,
+        size, mtime_ns), so a re-run over an unchanged tree costs one stat per file.
+        The stats and reads are throttled by `governor` when one is given.
+        """
+        categories = [self.classify_file(name) for _, name in files]
+        if sniff not in ("unknown", "all"):
+            return categories
+        governor = governor or IOGovernor()
+        with governor.idle():
+            return self._sniff_files(directory, files, sniff, categories, governor)
+
+    def _sniff_files(self, directory, files, sniff, categories, governor):
+        candidates, stat_results, prefixes = [], [], {}
+        for index, (rel_dir, name) in enumerate(files):
+            if sniff == "unknown" and categories[index] != "Others":
+                continue
+            if rel_dir not in prefixes:
+                prefixes[rel_dir] = os.path.join(directory, rel_dir, "")
+            path = prefixes[rel_dir] + name
+            governor.op()
+            try:
+                stat_results.append(os.stat(path))
+                candidates.append((index, path))
+            except OSError as e:
+                self.logger.warning(f"Error sniffing '{path}': {e}")
+        cache = self.file_cache
+        for (index, path), stat_result, sniffed in zip(candidates, stat_results, cache.get_many("magic", stat_results)):
+            if sniffed is None:
+                governor.op(min(stat_result.st_size, SNIFF_BYTES))
+                try:
+                    sniffed = self.sniff_kind(path) or ""
+                except OSError as e:
+                    self.logger.warning(f"Error sniffing '{path}': {e}")
+                    continue
+                cache.put("magic", stat_result, sniffed)
+            if sniffed and (categories[index] == "Others" or sniffed not in CONTAINER_SIGNATURES):
+                categories[index] = self.extension_index.get(sniffed, sniffed)
+        cache.flush()
+        return categories
+
+    def _move_file(self, src, dst):
+        """Move a file with a single rename, falling back to copy-and-delete across filesystems."""
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(src, dst)
+
+    def organize_files(self, directory, filenames=None, recursive=False, include=None, exclude=None, workers=None, layout=None, max_per_folder=None, sniff=None, dedup=None, io_ops=None, io_bytes=None, io_idle=None):
+        """Organize files in the given directory based on their extensions.
+
+        `filenames` limits the run to those files (used by watch mode); by default the
+        whole directory is scanned. With `recursive`, files in subdirectories are moved
+        into the top-level category folders too. `include`/`exclude` are glob patterns
+        matched against paths relative to `directory`, and `workers` threads scan and
+        move the tree partitioned by subdirectory. `layout` and `max_per_folder` shard
+        the destination folders (see `_plan_organize`), `sniff` classifies by content
+        (see `_classify_files`), and `dedup` handles duplicate files before they are
+        organized (see `_dedup_files`; full scans only, not watch batches).
+
+        The plan is journaled before anything moves (see `OrganizeJournal`). If an
+        earlier full run was interrupted, its journal is resumed instead of scanning.
+        Plain runs, with none of the options above, move files directly instead (see
+        `_organize_flat`). `io_ops`, `io_bytes` and `io_idle` throttle the run (see `IOGovernor`).
+        """
+        try:
+            start_time = time.monotonic()
+            workers = workers or (4 if recursive else 1)
+            governor = self._io_governor(io_ops, io_bytes, io_idle)
+            dedup_summary = None
+            journal = self._pending_journal("organize_files", directory) if filenames is None else None
+            plain = not (recursive or include or exclude or layout not in (None, "{category}") or max_per_folder or sniff not in (None, "off") or dedup in DEDUP_ACTIONS)
+            if journal is None:
+                if filenames is None:
+                    files = self._scan_for_organize(directory, recursive, include, exclude, workers, governor)
+                else:
+                    files = [("", name) for name in filenames if os.path.isfile(os.path.join(directory, name))]
+            if journal is None and plain:
+                summary = self._organize_flat(directory, files, governor)
+            else:
+                if journal is None:
+                    dedup_plan = []
+                    if dedup in DEDUP_ACTIONS and filenames is None:
+                        files, dedup_summary, dedup_plan = self._dedup_files(directory, files, dedup, governor)
+                    plan = dedup_plan + self._plan_organize(directory, files, layout, max_per_folder, sniff=sniff, governor=governor)
+                    journal = OrganizeJournal.create(self.journal_dir, "organize_files", directory, plan) if plan else None
+                summary = self._execute_organize_plan(journal, workers, governor)
+            summary.update({"directory": directory, "elapsed_seconds": round(time.monotonic() - start_time, 3)})
+            if dedup_summary is not None:
+                summary["dedup"] = dedup_summary
+            self.logger.info(f"File organization in '{directory}' completed successfully: {summary['moved']} moved, {summary['errors']} errors.")
+            self.log_to_mongodb("organize_files", summary, "Organization completed")
+        except Exception as e:
+            self.logger.error(f"Error organizing files in '{directory}': {e}")
+            self.log_to_mongodb("organize_files", {"directory": directory, "error": str(e)}, "Error", level="ERROR")
+
+    def _organize_flat(self, directory, files, governor):
+        """Move top-level files straight into their category folders, without a plan or journal.
+
+        Every move is one rename within `directory`, so there is little to resume and
+        the run is not journaled: it can't be undone. Names already taken in a
+        category folder get a numbered suffix, as in `_plan_organize`.
+        """
+        prefix = os.path.join(directory, "")
+        taken = {}
+        categories, renamed, errors = Counter(), 0, 0
+        for _, file in files:
+            governor.op()
+            category = self.classify_file(file)
+            if category not in taken:
+                os.makedirs(prefix + category, exist_ok=True)
+                taken[category] = set(os.listdir(prefix + category))
+            target_name = self._unique_name(file, taken[category])
+            taken[category].add(target_name)
+            try:
+                self._move_file(prefix + file, prefix + category + os.sep + target_name)
+            except OSError as e:
+                errors += 1
+                self.logger.error(f"Error moving '{prefix + file}': {e}")
+                continue
+            categories[category] += 1
+            renamed += target_name != file
+            self.logger.info(f"Moved '{file}' to '{category}' folder.")
+            self.log_to_mongodb("organize_files", {"file": file, "category": category}, "File moved")
+        return {"run_id": None, "resumed": False, "moved": sum(categories.values()), "renamed": renamed, "deleted": 0, "errors": errors, "categories": dict(categories)}
+
+    def reshard_folder(self, directory, category, layout=None, max_per_folder=None, workers=1):
+        """Re-shard the files of an existing flat category folder in place, using `layout` and `max_per_folder`."""
+        try:
+            start_time = time.monotonic()
+            journal = self._pending_journal("reshard_folder", directory)
+            if journal is None:
+                with os.scandir(os.path.join(directory, category)) as entries:
+                    files = [(category, entry.name) for entry in entries if entry.is_file()]
+                plan = self._plan_organize(directory, files, layout, max_per_folder, category=category, governor=self.io_governor)
+                journal = OrganizeJournal.create(self.journal_dir, "reshard_folder", directory, plan) if plan else None
+            summary = self._execute_organize_plan(journal, workers, self.io_governor)
+            summary.update({"directory": directory, "category": category, "elapsed_seconds": round(time.monotonic() - start_time, 3)})
+            self.logger.info(f"Re-sharded '{category}' in '{directory}': {summary['moved']} moved, {summary['errors']} errors.")
+            self.log_to_mongodb("reshard_folder", summary, "Reshard completed")
+            print(f"Re-sharded '{category}' in '{directory}': {summary['moved']} moved, {summary['errors']} errors.")
+        except Exception as e:
+            self.logger.error(f"Error re-sharding '{category}' in '{directory}': {e}")
+            self.log_to_mongodb("reshard_folder", {"directory": directory, "category": category, "error": str(e)}, "Error", level="ERROR")
+            print(f"Error re-sharding '{category}' in '{directory}': {e}")
+
+    def undo_organize(self, run_id=None, directory=None):
+        """Move the files of an organize or reshard run back, newest move first, using its journal.
+
+        With `directory` instead of `run_id`, the latest run for that directory that
+        moved anything is undone. Folders the run created are removed if they end up empty.
+        """
+        try:
+            if run_id:
+                paths = [path for path in OrganizeJournal.find(self.journal_dir, states=("pending", "complete")) if os.path.basename(path).startswith(f"{run_id}.")]
+            else:
+                paths = [path for path in OrganizeJournal.find(self.journal_dir, directory=directory, states=("pending", "complete")) if OrganizeJournal.read_header(path)["moves"]]
+            if not paths:
+                print(f"No organize run to undo for '{run_id or directory}'.")
+                return False
+            journal = OrganizeJournal.load(paths[-1])
+            if journal is None:
+                print(f"Run '{os.path.basename(paths[-1]).split('.')[0]}' is still in progress; undo it once it has finished.")
+                return False
+            restored, errors = 0, 0
+            for index in range(len(journal.moves) - 1, -1, -1):
+                src, dst, _ = journal.moves[index]
+                if dst is None:
+                    if index in journal.done:
+                        self.logger.warning(f"Deleted duplicate '{src}' can't be restored.")
+                    continue
+                # Moves that never happened, or were already undone, leave dst missing or src back in place
+                if index in journal.undone or not os.path.lexists(dst) or os.path.lexists(src):
+                    continue
+                try:
+                    os.makedirs(os.path.dirname(src), exist_ok=True)
+                    self._move_file(dst, src)
+                except OSError as e:
+                    errors += 1
+                    self.logger.error(f"Error moving '{dst}' back: {e}")
+                    continue
+                journal.mark("undone", [index])
+                restored += 1
+
+            root = journal.header["directory"]
+            for folder in sorted({os.path.dirname(os.path.abspath(dst)) for _, dst, _ in journal.moves if dst is not None}, key=len, reverse=True):
+                while folder.startswith(root + os.sep):
+                    try:
+                        os.rmdir(folder)
+                    except OSError:
+                        break
+                    folder = os.path.dirname(folder)
+            journal.finish("undone")
+
+            summary = {"run_id": journal.run_id, "directory": root, "restored": restored, "errors": errors}
+            self.logger.info(f"Undid run '{journal.run_id}': {restored} restored, {errors} errors.")
+            self.log_to_mongodb("undo_organize", summary, "Undo completed")
+            print(f"Undid run '{journal.run_id}' in '{root}': {restored} files restored, {errors} errors.")
+            return errors == 0
+        except Exception as e:
+            self.logger.error(f"Error undoing organize run '{run_id or directory}': {e}")
+            self.log_to_mongodb("undo_organize", {"run_id": run_id, "directory": directory, "error": str(e)}, "Error", level="ERROR")
+            print(f"Error undoing organize run '{run_id or directory}': {e}")
+            return False
+
+    def _pending_journal(self, task_name, directory):
+        """Return the newest interrupted journal of `task_name` for `directory`, or None."""
+        for path in reversed(OrganizeJournal.find(self.journal_dir, task_name, directory, states=("pending",))):
+            journal = OrganizeJournal.load(path)
+            # A journal another run still holds is in progress, not interrupted
+            if journal is None:
+                continue
+            if journal.header["directory"] == os.path.abspath(directory):
+                self.logger.info(f"Resuming run '{journal.run_id}': {len(journal.moves) - len(journal.done)} of {len(journal.moves)} moves left.")
+                return journal
+            journal.close()
+        return None
+
+    @staticmethod
+    def _layout_fields(layout):
+        """Return the placeholders used by a destination layout, checking that it starts with {category}."""
+        fields = {field for _, field, _, _ in string.Formatter().parse(layout) if field is not None}
+        if not layout.startswith("{category}") or not fields <= LAYOUT_FIELDS:
+            raise ValueError(f"Invalid layout '{layout}': it must start with {{category}} and may use {sorted(LAYOUT_FIELDS)}")
+        return fields
+
+    @staticmethod
+    def _matches_any(rel_path, patterns):
+        """Return True if a relative path or its file name matches any glob pattern."""
+        rel_path = rel_path.replace(os.sep, "/")
+        name = rel_path.rsplit("/", 1)[-1]
+        return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+    @staticmethod
+    def _walk_tree(visit, roots, workers, governor=None):
+        """Call `visit` on each of `roots` and on every item it returns, spread across `workers` threads.
+
+        With a `governor`, each call counts as one I/O operation and runs under its I/O priority.
+        """
+        if governor is not None:
+            listing = visit
+
+            def visit(item):
+                governor.op()
+                return listing(item)
+
+            visit = governor.wrap(visit)
+        if workers <= 1:
+            pending = list(roots)
+            while pending:
+                pending.extend(visit(pending.pop()))
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(visit, root) for root in roots}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    futures.update(pool.submit(visit, item) for item in future.result())
+
+    def _scan_for_organize(self, directory, recursive, include, exclude, workers, governor=None):
+        """List the files to organize as (relative dir, name) pairs, scanning subdirectories in parallel."""
+        category_folders = set(self.file_types) | {"Others", DUPLICATES_FOLDER}
+        files = []
+
+        def scan(rel_dir):
+            subdirs = []
+            # DirEntry carries the file type from the directory listing, so no extra stat per entry
+            with os.scandir(os.path.join(directory, rel_dir)) as entries:
+                for entry in entries:
+                    rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    if exclude and self._matches_any(rel_path, exclude):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not (rel_dir == "" and entry.name in category_folders):
+                            subdirs.append(rel_path)
+                    elif entry.is_file() and (not include or self._matches_any(rel_path, include)):
+                        files.append((rel_dir, entry.name))
+            return subdirs
+
+        self._walk_tree(scan, [""], workers if recursive else 1, governor)
+        return files
+
+    @staticmethod
+    def _quick_hash(path, size, governor=None):
+        """Hash the first and last few KB of a file, to split same-size candidates cheaply."""
+        digest = hashlib.blake2b(digest_size=16)
+        if governor is not None:
+            governor.op(min(size, 2 * QUICK_HASH_BYTES))
+        with open(path, "rb") as f:
+            digest.update(f.read(QUICK_HASH_BYTES))
+            if size > 2 * QUICK_HASH_BYTES:
+                f.seek(-QUICK_HASH_BYTES, os.SEEK_END)
+                digest.update(f.read(QUICK_HASH_BYTES))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _full_hash(path, governor=None):
+        """SHA-256 of a whole file, read in fixed-size chunks."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            if governor is not None:
+                f = governor.reader(f)
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _find_duplicates(self, candidates, governor=None, new=None):
+        """Group (path, stat) pairs into sets of files with identical content.
+
+        Three passes, each only over what the previous one could not rule out:
+        bucket by size, then by a head/tail hash, then by a full SHA-256. Both
+        hashes are cached on (device, inode, size, mtime_ns), so repeat runs only
+        hash new or changed files. Hard links to the same inode are not duplicates.
+        When a set of `new` paths is given, only groups holding one of them are kept.
+        """
+        by_size = defaultdict(dict)
+        for path, stat_result in candidates:
+            if stat_result.st_size > 0:
+                by_size[stat_result.st_size].setdefault((stat_result.st_dev, stat_result.st_ino), (path, stat_result))
+
+        def has_new(pairs):
+            return new is None or any(path in new for path, _ in pairs)
+
+        cache = self.file_cache
+        groups = []
+        for size, bucket in by_size.items():
+            if len(bucket) < 2 or not has_new(bucket.values()):
+                continue
+            by_quick_hash = defaultdict(list)
+            cached = cache.get_many("quick", [stat_result for _, stat_result in bucket.values()])
+            for (path, stat_result), quick_hash in zip(bucket.values(), cached):
+                if quick_hash is None:
+                    try:
+                        quick_hash = self._quick_hash(path, size, governor)
+                    except OSError as e:
+                        self.logger.warning(f"Error hashing '{path}': {e}")
+                        continue
+                    cache.put("quick", stat_result, quick_hash)
+                by_quick_hash[quick_hash].append((path, stat_result))
+            for same_quick_hash in by_quick_hash.values():
+                if len(same_quick_hash) < 2 or not has_new(same_quick_hash):
+                    continue
+                by_full_hash = defaultdict(list)
+                cached = cache.get_many("sha256", [stat_result for _, stat_result in same_quick_hash])
+                for (path, stat_result), full_hash in zip(same_quick_hash, cached):
+                    if full_hash is None:
+                        try:
+                            full_hash = self._full_hash(path, governor)
+                        except OSError as e:
+                            self.logger.warning(f"Error hashing '{path}': {e}")
+                            continue
+                        cache.put("sha256", stat_result, full_hash)
+                    by_full_hash[full_hash].append(path)
+                groups.extend(paths for paths in by_full_hash.values() if len(paths) > 1 and (new is None or any(path in new for path in paths)))
+        cache.flush()
+        return groups
+
+    def _dedup_files(self, directory, files, action, governor=None):
+        """Find duplicates among the files to organize and the already organized ones, and apply `action`.
+
+        Only groups holding a file to organize count, and only those files are ever
+        changed: already organized copies of each other are left alone. The copy
+        kept is an already organized file if there is one, otherwise the first in
+        sorted path order. "report" only logs; "hardlink" replaces each duplicate
+        with a hard link to the kept copy. "move" (into the Duplicates folder) and
+        "delete" drop duplicates from the run and return them as plan entries
+        [src, dst, "Duplicates"], with dst None for a deletion, so they are
+        journaled and carried out with the rest of the plan.
+        Returns the remaining files, a summary and those plan entries.
+        """
+        if not files:
+            return files, {"action": action, "groups": 0, "duplicates": 0, "bytes_duplicated": 0, "errors": 0, "sample": []}, []
+        governor = governor or IOGovernor()
+        with governor.idle():
+            organized = []
+            for category in sorted(set(self.file_types) | {"Others"}):
+                for root, _, names in os.walk(os.path.join(directory, category)):
+                    governor.op()
+                    organized.extend(os.path.join(root, name) for name in names)
+            organized_set = set(organized)
+            paths = {os.path.join(directory, rel_dir, name): (rel_dir, name) for rel_dir, name in files}
+
+            candidates = []
+            for path in organized + list(paths):
+                governor.op()
+                try:
+                    candidates.append((path, os.stat(path)))
+                except OSError:
+                    continue
+            groups = self._find_duplicates(candidates, governor, new=paths.keys())
+
+        plan = []
+        duplicates, bytes_duplicated, errors = 0, 0, 0
+        duplicates_folder = os.path.join(directory, DUPLICATES_FOLDER)
+        taken = None
+        for group in groups:
+            keeper, *copies = sorted(group, key=lambda path: (path not in organized_set, paths.get(path, ("", path))))
+            for path in copies:
+                if path not in paths:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                    if action == "hardlink":
+                        tmp_path = f"{path}.dedup-tmp"
+                        os.link(keeper, tmp_path)
+                        os.replace(tmp_path, path)
+                    elif action == "move":
+                        if taken is None:
+                            taken = set(os.listdir(duplicates_folder)) if os.path.isdir(duplicates_folder) else set()
+                        target_name = self._unique_name(os.path.basename(path), taken)
+                        taken.add(target_name)
+                        plan.append((path, os.path.join(duplicates_folder, target_name), DUPLICATES_FOLDER))
+                    elif action == "delete":
+                        plan.append((path, None, DUPLICATES_FOLDER))
+                except OSError as e:
+                    errors += 1
+                    self.logger.error(f"Error handling duplicate '{path}': {e}")
+                    continue
+                duplicates += 1
+                bytes_duplicated += size
+                self.logger.info(f"Duplicate of '{keeper}': '{path}' ({action})")
+
+        summary = {
+            "action": action,
+            "groups": len(groups),
+            "duplicates": duplicates,
+            "bytes_duplicated": bytes_duplicated,
+            "errors": errors,
+            "sample": [sorted(group) for group in groups[:10]],
+        }
+        self.log_to_mongodb("organize_files", {"directory": directory, **summary}, "Duplicates found" if groups else "No duplicates found")
+        removed = {src for src, _, _ in plan}
+        remaining = [paths[path] for path in paths if path not in removed]
+        return remaining, summary, plan
+
+    @staticmethod
+    def _unique_name(name, taken):
+        """Return `name`, or `name (1)`, `name (2)`, ... if it is already taken."""
+        if name not in taken:
+            return name
+        stem, ext = os.path.splitext(name)
+        number = 1
+        while f"{stem} ({number}){ext}" in taken:
+            number += 1
+        return f"{stem} ({number}){ext}"
+
+    def _plan_organize(self, directory, files, layout=None, max_per_folder=None, category=None, sniff=None, governor=None):
+        """Map each file to its destination, resolving name collisions deterministically.
+
+        The destination folder comes from `layout`, e.g. "{category}/{YYYY}/{MM}" (file
+        mtime) or "{category}/{hash}" (two hex digits of the name's hash). Once a folder
+        holds `max_per_folder` entries, further files spill into numbered subfolders
+        (0001, 0002, ...); only files count towards the limit. `category` overrides classification (used by reshard).
+
+        Names are assigned in sorted path order (top-level files first), so the same
+        tree always produces the same destination names. The plan itself keeps the
+        scan order, which is the directory's on-disk order and the cheapest to rename in.
+        """
+        layout = layout or "{category}"
+        fields = self._layout_fields(layout)
+        categories = [category] * len(files) if category else self._classify_files(directory, files, sniff, governor)
+        if layout == "{category}":
+            folders = categories
+        else:
+            folders = []
+            for (rel_dir, name), file_category in zip(files, categories):
+                values = {"category": file_category}
+                if fields & {"YYYY", "MM", "DD"}:
+                    if governor is not None:
+                        governor.op()
+                    mtime = time.localtime(os.stat(os.path.join(directory, rel_dir, name)).st_mtime)
+                    values.update(YYYY=f"{mtime.tm_year:04d}", MM=f"{mtime.tm_mon:02d}", DD=f"{mtime.tm_mday:02d}")
+                if "hash" in fields:
+                    values["hash"] = hashlib.md5(name.encode("utf-8", "surrogateescape")).hexdigest()[:2]
+                folders.append(os.path.normpath(layout.format(**values)))
+
+        # Files already inside a target folder (reshard) don't count against it
+        outgoing = defaultdict(set)
+        if category is not None:
+            for rel_dir, name in files:
+                outgoing[os.path.normpath(rel_dir)].add(name)
+        taken = {}
+        file_counts = {}
+        spill_index = {}
+
+        def load_folder(folder):
+            if folder not in taken:
+                names, file_names = set(), set()
+                path = os.path.join(directory, folder)
+                if os.path.isdir(path):
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            names.add(entry.name)
+                            if not entry.is_dir():
+                                file_names.add(entry.name)
+                taken[folder] = names - outgoing.get(folder, set())
+                file_counts[folder] = len(file_names - outgoing.get(folder, set()))
+
+        def folder_with_room(folder):
+            if not max_per_folder:
+                load_folder(folder)
+                return folder
+            index = spill_index.get(folder, 0)
+            while True:
+                candidate = folder if index == 0 else os.path.join(folder, f"{index:04d}")
+                load_folder(candidate)
+                if file_counts[candidate] < max_per_folder:
+                    spill_index[folder] = index
+                    return candidate
+                index += 1
+
+        target_folders = [None] * len(files)
+        target_names = [None] * len(files)
+        for index in sorted(range(len(files)), key=files.__getitem__):
+            folder = folder_with_room(folders[index])
+            target_name = self._unique_name(files[index][1], taken[folder])
+            taken[folder].add(target_name)
+            file_counts[folder] += 1
+            target_folders[index] = folder
+            target_names[index] = target_name
+
+        source_prefixes = {}
+        target_prefixes = {}
+        plan = []
+        for (rel_dir, name), file_category, folder, target_name in zip(files, categories, target_folders, target_names):
+            if rel_dir not in source_prefixes:
+                source_prefixes[rel_dir] = os.path.join(directory, rel_dir, "")
+            if folder not in target_prefixes:
+                target_prefixes[folder] = os.path.join(directory, folder, "")
+            src, dst = source_prefixes[rel_dir] + name, target_prefixes[folder] + target_name
+            if os.path.normpath(src) != os.path.normpath(dst):
+                plan.append((src, dst, file_category))
+        return plan
+
+    def _execute_organize_plan(self, journal, workers, governor):
+        """Carry out the moves a journal has not done yet, one source directory per worker task.
+
+        Each category folder is created once, and moves are checkpointed in the
+        journal in batches of JOURNAL_MARK_BATCH per worker. When resuming, a move whose destination already exists was done
+        before the interruption if its source is gone, and is skipped as an error
+        otherwise, so nothing is overwritten. The journal is marked complete at the end.
+        An empty plan has no journal (None), so idle runs leave nothing to undo or prune.
+        Entries without a destination are duplicates to delete (see `_dedup_files`).
+        """
+        if journal is None:
+            return {"run_id": None, "resumed": False, "moved": 0, "renamed": 0, "deleted": 0, "errors": 0, "categories": {}}
+        task_name = journal.header["task"]
+        plan = [(index, move) for index, move in enumerate(journal.moves) if index not in journal.done]
+        for category_folder in {dst.rpartition(os.sep)[0] for _, (_, dst, _) in plan if dst is not None}:
+            os.makedirs(category_folder, exist_ok=True)
+
+        def move_group(moves):
+            categories, renamed, deleted, errors = Counter(), 0, 0, 0
+            done = []
+            for index, (src, dst, category) in moves:
+                if len(done) >= JOURNAL_MARK_BATCH:
+                    journal.mark("done", done)
+                    done = []
+                governor.op()
+                if dst is None:
+                    try:
+                        os.remove(src)
+                    except FileNotFoundError:
+                        if not journal.resumed:
+                            errors += 1
+                            self.logger.error(f"Error deleting duplicate '{src}': it no longer exists")
+                            continue
+                    except OSError as e:
+                        errors += 1
+                        self.logger.error(f"Error deleting duplicate '{src}': {e}")
+                        continue
+                    done.append(index)
+                    deleted += 1
+                    self.logger.info(f"Deleted duplicate '{src}'.")
+                    self.log_to_mongodb(task_name, {"file": src}, "Duplicate deleted")
+                    continue
+                try:
+                    if journal.resumed and os.path.lexists(dst):
+                        if not os.path.lexists(src):
+                            done.append(index)
+                            continue
+                        raise FileExistsError(errno.EEXIST, "Destination already exists", dst)
+                    self._move_file(src, dst)
+                except OSError as e:
+                    errors += 1
+                    self.logger.error(f"Error moving '{src}': {e}")
+                    continue
+                done.append(index)
+                file = src.rpartition(os.sep)[2]
+                categories[category] += 1
+                renamed += not dst.endswith(os.sep + file)
+                self.logger.info(f"Moved '{file}' to '{category}' folder.")
+                self.log_to_mongodb(task_name, {"file": file, "category": category}, "File moved")
+            journal.mark("done", done)
+            return categories, renamed, deleted, errors
+
+        groups = defaultdict(list)
+        for index, move in plan:
+            groups[move[0].rpartition(os.sep)[0]].append((index, move))
+        move_group = governor.wrap(move_group)
+        if workers <= 1 or len(groups) <= 1:
+            results = [move_group(moves) for moves in groups.values()]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(move_group, groups.values()))
+        journal.finish("complete")
+        OrganizeJournal.prune(self.journal_dir, self.journal_keep)
+
+        categories = Counter()
+        for group_categories, *_ in results:
+            categories.update(group_categories)
+        return {
+            "run_id": journal.run_id,
+            "resumed": journal.resumed,
+            "moved": sum(categories.values()),
+            "renamed": sum(result[1] for result in results),
+            "deleted": sum(result[2] for result in results),
+            "errors": sum(result[3] for result in results),
+            "categories": dict(categories),
+        }
+
+    def delete_files(self, directory, age_days, formats, exclude=None, prune=None, max_depth=None, workers=None, index=None, quota=None, quota_low=None, evict_by="mtime", io_ops=None, io_bytes=None, io_idle=None):
+        """Delete files older than `age_days` and matching `formats`.
+
+        The tree is walked with scandir, subdirectories in parallel across `workers`
+        threads, and only files with a matching extension are stat'ed. `exclude`
+        globs keep matching files, `prune` globs skip matching subdirectories
+        entirely, and `max_depth` limits how many directory levels below `directory`
+        are walked. Deletions are logged in batches (see `DeletionReport`), then a summary.
+
+        With `index`, the walk is replaced by a persistent expiry index (see
+        `_refresh_expiry_index`), and each file it reports as expired has its mtime
+        checked again before it is deleted.
+
+        With `quota`, the tree's disk usage is measured in the same walk, and once it
+        exceeds `quota` the oldest matching files by `evict_by` ("mtime" or "atime")
+        are deleted until it is back under `quota_low` (default `quota`); see
+        `_evict_to_quota`. `age_days` is optional in this mode, and `formats` None
+        matches every file.
+
+        `io_ops`, `io_bytes` and `io_idle` throttle the run (see `IOGovernor`);
+        directory listings, stats of indexed files and deletions count as operations.
+        """
+        try:
+            start_time = time.monotonic()
+            workers = workers or 4
+            governor = self._io_governor(io_ops, io_bytes, io_idle)
+            cutoff_time = None if age_days is None else time.time() - (age_days * 86400)
+            extensions = None if formats is None else {file_format.lower() for file_format in formats}
+            report = DeletionReport(lambda details: self.log_to_mongodb("delete_files", {"directory": directory, **details}, "Files deleted"))
+
+            def list_dir(item):
+                """Return the matching files as (path, mtime, size) and the subdirectories to walk, for one directory."""
+                rel_dir, depth = item
+                files, subdirs = [], []
+                with os.scandir(os.path.join(directory, rel_dir)) as entries:
+                    for entry in entries:
+                        rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if (max_depth is None or depth < max_depth) and not (prune and self._matches_any(rel_path, prune)):
+                                subdirs.append((rel_path, depth + 1))
+                        elif (extensions is None or os.path.splitext(entry.name)[1].lower() in extensions) and entry.is_file():
+                            if exclude and self._matches_any(rel_path, exclude):
+                                continue
+                            try:
+                                stat_result = entry.stat()
+                            except OSError:
+                                continue
+                            files.append((entry.path, stat_result.st_mtime, stat_result.st_size))
+                return files, subdirs
+
+            def remove(file_path, size):
+                governor.op()
+                try:
+                    os.remove(file_path)
+                except OSError as e:
+                    report.error()
+                    self.logger.error(f"Error deleting '{file_path}': {e}")
+                    return False
+                report.add(file_path, size)
+                self.logger.info(f"Deleted file: {file_path}")
+                return True
+
+            rescanned_dirs = quota_summary = None
+            if quota is not None:
+                quota_summary = self._evict_to_quota(directory, extensions, exclude, prune, max_depth, workers, governor, cutoff_time, parse_size(quota), parse_size(quota if quota_low is None else quota_low), evict_by, remove)
+            elif index:
+                scope = ExpiryIndex.scope(directory, extensions, exclude, prune, max_depth)
+                rescanned_dirs = self._refresh_expiry_index(scope, directory, list_dir, workers, governor)
+                expired = defaultdict(list)
+                for file_path, rel_dir in self.expiry_index.expired(scope, cutoff_time):
+                    expired[rel_dir].append(file_path)
+                known = self.expiry_index.dirs(scope)
+                removed, touched, dir_mtimes = [], [], {}
+                for rel_dir, file_paths in expired.items():
+                    # Our deletions change the directory's mtime. The new one is stored only if nothing else had
+                    # changed it since it was indexed; otherwise the stale indexed mtime gets it rescanned next run.
+                    unchanged = self._dir_mtime_ns(directory, rel_dir, governor) == known.get(rel_dir, (None, None))[1]
+                    deleted = False
+                    for file_path in file_paths:
+                        # A file rewritten in place doesn't change its directory's mtime, so the indexed mtime may be stale
+                        governor.op()
+                        try:
+                            stat_result = os.stat(file_path)
+                        except FileNotFoundError:
+                            removed.append(file_path)
+                            continue
+                        except OSError:
+                            continue
+                        if stat_result.st_mtime >= cutoff_time:
+                            touched.append((file_path, stat_result.st_mtime))
+                        elif remove(file_path, stat_result.st_size):
+                            removed.append(file_path)
+                            deleted = True
+                    if unchanged and deleted:
+                        mtime_ns = self._dir_mtime_ns(directory, rel_dir, governor)
+                        if mtime_ns is not None:
+                            dir_mtimes[rel_dir] = mtime_ns
+                self.expiry_index.update(scope, removed, touched, dir_mtimes)
+            else:
+                def sweep(item):
+                    files, subdirs = list_dir(item)
+                    for file_path, mtime, size in files:
+                        if mtime < cutoff_time:
+                            remove(file_path, size)
+                    return subdirs
+
+                self._walk_tree(sweep, [("", 0)], workers, governor)
+
+            report.flush()
+            summary = {
+                "directory": directory,
+                "deleted": report.deleted,
+                "bytes_freed": report.bytes_freed,
+                "errors": report.errors,
+                "batches": report.batches,
+                "elapsed_seconds": round(time.monotonic() - start_time, 3),
+            }
+            if rescanned_dirs is not None:
+                summary["rescanned_dirs"] = rescanned_dirs
+            if quota_summary is not None:
+                summary.update(quota_summary)
+            if report.deleted:
+                self.logger.info(f"Deleted {report.deleted} files ({report.bytes_freed} bytes) in '{directory}'.")
+                self.log_to_mongodb("delete_files", summary, "Deletion completed")
+            else:
+                self.logger.info("No files deleted.")
+                self.log_to_mongodb("delete_files", summary, "No files deleted")
+        except Exception as e:
+            self.logger.error(f"Error deleting files: {e}")
+            self.log_to_mongodb("delete_files", {"directory": directory, "age_days": age_days, "formats": formats}, f"Error: {e}", level="ERROR")
+
+    def _evict_to_quota(self, directory, extensions, exclude, prune, max_depth, workers, governor, cutoff_time, high, low, evict_by, remove):
+        """Measure the tree's disk usage and, above `high` bytes, delete the oldest candidates until it is at most `low`.
+
+        Every file counts towards usage; only regular files matching `extensions`
+        and not `exclude` are candidates. Candidates past `cutoff_time` (if any)
+        are deleted during the walk, and the rest are evicted from a heap ordered
+        by mtime or atime, so only as many are ordered as need to go.
+        """
+        usage_parts, candidates = [], []
+
+        def measure(item):
+            rel_dir, depth = item
+            usage, expired, subdirs = 0, [], []
+            with os.scandir(os.path.join(directory, rel_dir)) as entries:
+                for entry in entries:
+                    rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if (max_depth is None or depth < max_depth) and not (prune and self._matches_any(rel_path, prune)):
+                            subdirs.append((rel_path, depth + 1))
+                        continue
+                    try:
+                        stat_result = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    size = allocated_bytes(stat_result)
+                    usage += size
+                    if not entry.is_file(follow_symlinks=False) or (extensions is not None and os.path.splitext(entry.name)[1].lower() not in extensions):
+                        continue
+                    if exclude and self._matches_any(rel_path, exclude):
+                        continue
+                    if cutoff_time is not None and stat_result.st_mtime < cutoff_time:
+                        expired.append((entry.path, size))
+                    else:
+                        candidates.append((stat_result.st_atime if evict_by == "atime" else stat_result.st_mtime, entry.path, size))
+            for file_path, size in expired:
+                if remove(file_path, size):
+                    usage -= size
+            usage_parts.append(usage)
+            return subdirs
+
+        self._walk_tree(measure, [("", 0)], workers, governor)
+        usage = usage_before = sum(usage_parts)
+        if usage > high:
+            heapq.heapify(candidates)
+            while candidates and usage > low:
+                _, file_path, size = heapq.heappop(candidates)
+                if remove(file_path, size):
+                    usage -= size
+        if usage > low:
+            self.logger.warning(f"'{directory}' is still at {usage} bytes, over its {low} byte quota: not enough files can be evicted.")
+        return {"quota_bytes": high, "quota_low_bytes": low, "evict_by": evict_by, "usage_bytes_before": usage_before, "usage_bytes_after": usage}
+
+    @staticmethod
+    def _dir_mtime_ns(directory, rel_dir, governor):
+        """mtime_ns of a directory under `directory`, or None if it can't be read."""
+        governor.op()
+        try:
+            return os.stat(os.path.join(directory, rel_dir)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh_expiry_index(self, scope, directory, list_dir, workers, governor):
+        """Bring the expiry index for `scope` up to date and return how many directories were rescanned.
+
+        The first run walks the whole tree. Later runs only stat the indexed
+        directories: those whose mtime changed are rescanned with `list_dir`, new
+        subdirectories are walked, and vanished ones are dropped with their subtree.
+        """
+        known = self.expiry_index.dirs(scope)
+
+        def dir_mtime(rel_dir):
+            return self._dir_mtime_ns(directory, rel_dir, governor)
+
+        if known:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                mtimes = dict(zip(known, pool.map(governor.wrap(dir_mtime), known)))
+            vanished = [rel_dir for rel_dir, mtime_ns in mtimes.items() if mtime_ns is None]
+            changed = [(rel_dir, known[rel_dir][0]) for rel_dir, mtime_ns in mtimes.items() if mtime_ns is not None and mtime_ns != known[rel_dir][1]]
+        else:
+            vanished, changed = [], [("", 0)]
+
+        scanned = []
+
+        def rescan(item):
+            rel_dir, depth = item
+            # Stat before listing, so changes made during the listing show up as a changed mtime next run
+            mtime_ns = dir_mtime(rel_dir)
+            try:
+                files, subdirs = list_dir(item)
+            except FileNotFoundError:
+                mtime_ns = None
+            if mtime_ns is None:
+                vanished.append(rel_dir)
+                return []
+            scanned.append((rel_dir, depth, mtime_ns, files, {subdir for subdir, _ in subdirs}))
+            return [subdir for subdir in subdirs if subdir[0] not in known]
+
+        self._walk_tree(rescan, changed, workers, governor)
+
+        children = defaultdict(set)
+        for rel_dir in known:
+            if rel_dir:
+                children[os.path.dirname(rel_dir)].add(rel_dir)
+        for rel_dir, _, _, _, subdirs in scanned:
+            vanished.extend(children[rel_dir] - subdirs)
+        self.expiry_index.apply(scope, [entry[:4] for entry in scanned], vanished)
+        return len(scanned)
+
+    def send_email(self, recipient_email, subject, message, attachments=None, workers=None, rate=None, campaign=None, engine=None):
+        """Send email(s) with optional attachments.
+
+        A CSV/XLSX recipient list is read in chunks of RECIPIENT_CHUNK_SIZE rows and checked
+        in full (addresses normalized, invalid and duplicate rows counted) before anything
+        is sent. Its recipients are queued in the email outbox under `campaign` (by default
+        an id derived from the list, subject, message and attachments), and only those not
+        yet sent are mailed, so a crashed or repeated run resumes instead of starting over.
+        Messages are sent by `workers` threads (default EMAIL_WORKERS), or by as many sessions
+        on one event loop with the "asyncio" `engine` (default EMAIL_ENGINE, else "threads"),
+        at no more than `rate` messages (e.g. '10/s', '600/min'; default EMAIL_RATE, unlimited if unset).
+        Failed sends are retried with backoff by a one-off run scheduled for when the
+        earliest retry is due (or by the next run), and a campaign summary is logged.
+        """
+        SENDER_EMAIL = os.getenv("SENDER_EMAIL")
+        SENDER_PASSWORD = os.getenv("SENDER_PASSWORD")
+        # A relay configured through SMTP_HOST may accept mail without logging in
+        if not SENDER_EMAIL or not (SENDER_PASSWORD or os.getenv("SMTP_HOST")):
+            self.logger.error("Missing email credentials in .env file.")
+            return False
+
+        if isinstance(recipient_email, str) and (recipient_email.endswith(".csv") or recipient_email.endswith(".xlsx")):
+            try:
+                message_template = self._message_template(message)
+                subject_template = MessageTemplate(subject)
+
+                outbox = self.email_outbox
+                campaign_id = campaign or EmailOutbox.campaign_id(recipient_email, subject, message_template.source, attachments)
+                outbox.open_campaign(campaign_id, recipient_email, subject)
+                chunksize = int(os.getenv("RECIPIENT_CHUNK_SIZE", RECIPIENT_CHUNK_SIZE))
+                counts = Counter()
+                for index, chunk in enumerate(self._recipient_chunks(recipient_email, chunksize, counts)):
+                    if index == 0:
+                        unmatched = sorted({*subject_template.unmatched_fields(chunk.columns), *message_template.unmatched_fields(chunk.columns)})
+                        if unmatched:
+                            fields = ", ".join(f"{{{field}}}" for field in unmatched)
+                            self.logger.warning(f"Template field(s) {fields} match no column of '{recipient_email}' and will be empty; give a default ({{{unmatched[0]}|...}}) or write literal braces as {{{{ and }}}}.")
+                    counts["queued"] += outbox.add(campaign_id, chunk)
+                totals = outbox.totals(campaign_id)
+                self.logger.info(
+                    f"Recipient list '{recipient_email}': {counts['valid']} valid, {counts['invalid']} invalid, {counts['duplicate']} duplicate; "
+                    f"campaign '{campaign_id}': {counts['queued']} newly queued, {totals['sent']} already sent, {totals['pending'] + totals['retry']} to send."
+                )
+                if totals["sent"] and not totals["pending"] + totals["retry"]:
+                    self.logger.warning(f"Campaign '{campaign_id}' has already been sent to every recipient in '{recipient_email}'; use a new --campaign name to send it again.")
+                self.log_to_mongodb(
+                    "send_email",
+                    {"email_list": recipient_email, "campaign": campaign_id, "valid": counts["valid"], "invalid": counts["invalid"], "duplicate": counts["duplicate"], "queued": counts["queued"], "already_sent": totals["sent"]},
+                    "Recipients checked",
+                )
+
+                # Outbox keys become Message-IDs, so a message re-sent after a crash can be recognized as a duplicate
+                domain = SENDER_EMAIL.rpartition("@")[2] or "localhost"
+
+                def messages():
+                    import pandas as pd
+
+                    for page in outbox.due(campaign_id, time.time()):
+                        rows = pd.DataFrame([fields for _, fields, _ in page], dtype=str)
+                        for (recipient, _, key), row_subject, body in zip(page, subject_template.render(rows), message_template.render(rows)):
+                            yield recipient, row_subject, body, f"<{key}@{domain}>"
+
+                def on_result(recipient, error):
+                    return outbox.record(campaign_id, recipient, error, error is None or SMTPPool._is_transient(error))
+
+                start_time = time.monotonic()
+                workers = workers or int(os.getenv("EMAIL_WORKERS", "4"))
+                engine = engine or os.getenv("EMAIL_ENGINE", "threads")
+                if engine not in EMAIL_ENGINES:
+                    raise ValueError(f"Unknown email engine '{engine}': use one of {', '.join(EMAIL_ENGINES)}")
+                dispatch = self._dispatch_emails_async if engine == "asyncio" else self._dispatch_emails
+                encoded = self._encode_attachments(attachments)
+                with self._email_campaigns_lock:
+                    running = campaign_id in self._email_campaigns
+                    self._email_campaigns.add(campaign_id)
+                if running:
+                    self.logger.warning(f"Campaign '{campaign_id}' is already being sent; this run only queued new recipients.")
+                    for attachment in encoded:
+                        attachment.close()
+                    return True
+                try:
+                    dispatch(messages(), encoded, workers, parse_rate(rate or os.getenv("EMAIL_RATE")), counts, on_result)
+                finally:
+                    with self._email_campaigns_lock:
+                        self._email_campaigns.discard(campaign_id)
+                    for attachment in encoded:
+                        attachment.close()
+                outbox.finish(campaign_id)
+                # Retries aren't waited for here, which would hold a scheduler thread until they fall due
+                next_retry = outbox.next_retry(campaign_id)
+                if next_retry is not None:
+                    self._schedule_email_retry(campaign_id, next_retry, [recipient_email, subject, message, attachments], {"workers": workers, "rate": rate, "campaign": campaign, "engine": engine})
+                elapsed = time.monotonic() - start_time
+                summary = {
+                    "email_list": recipient_email,
+                    "campaign": campaign_id,
+                    "sent": counts["sent"],
+                    "retried": counts["retry"],
+                    "failed": counts["failed"],
+                    "already_sent": totals["sent"],
+                    "invalid": counts["invalid"],
+                    "duplicate": counts["duplicate"],
+                    "throttled": counts["throttled"],
+                    "workers": workers,
+                    "engine": engine,
+                    "elapsed_seconds": round(elapsed, 3),
+                    "messages_per_second": round(counts["sent"] / elapsed, 2) if elapsed else None,
+                }
+                self.logger.info(f"Campaign '{recipient_email}' finished: {counts['sent']} sent, {counts['retry']} retried, {counts['failed']} failed, {totals['sent']} already sent, {counts['invalid']} invalid, {counts['duplicate']} duplicate, {counts['throttled']} throttled.")
+                self.log_to_mongodb("send_email", summary, "Campaign completed")
+                return counts["failed"] == 0
+
+            except Exception as e:
+                self.logger.error(f"Error sending emails from file: {e}")
+                self.log_to_mongodb("send_email", {"email_list": recipient_email, "message": message, "subject": subject, "attachments": attachments}, f"Error: {e}", level="ERROR")
+                return False
+        else:
+            if self._send_single_email(recipient_email, subject, message, attachments):
+                self.logger.info(f"Email sent to {recipient_email}")
+                self.log_to_mongodb("send_email", {"recipient": recipient_email, "subject": subject}, "Email sent")
+                return True
+            else:
+                self.logger.error(f"Failed to send email to {recipient_email}")
+                self.log_to_mongodb("send_email", {"recipient": recipient_email, "subject": subject}, "Email failed", level="ERROR")
+                return False
+
+    def _schedule_email_retry(self, campaign_id, retry_at, args, kwargs):
+        """Run send_email again once a campaign's earliest retry is due, or leave retries to its next run without a scheduler."""
+        when = datetime.fromtimestamp(retry_at)
+        if self.scheduler is None or not self.scheduler.running:
+            self.logger.info(f"Campaign '{campaign_id}' has retries due from {when:%Y-%m-%d %H:%M:%S}; they are sent on its next run.")
+            return
+        executor = self._job_options({"task_type": "send_email"})["executor"]
+        func, args, kwargs = self._job_callable(self.send_email, args, kwargs, executor)
+        self.scheduler.add_job(
+            func, "date", run_date=when.astimezone(self.scheduler.timezone), args=args, kwargs=kwargs,
+            id=f"send_email-retry-{campaign_id}", name=f"send_email retry ({campaign_id})", executor=executor, replace_existing=True,
+        )
+        self.logger.info(f"Campaign '{campaign_id}' retries scheduled for {when:%Y-%m-%d %H:%M:%S}.")
+
+    def _message_template(self, message):
+        """Compile a send_email message, given as text or a file path; files are recompiled only when they change."""
+        if not os.path.isfile(message):
+            return MessageTemplate(message)
+        stat = os.stat(message)
+        cached = self._templates.get(message)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(message, "r") as f:
+            template = MessageTemplate(f.read())
+        self._templates[message] = (stat.st_mtime_ns, stat.st_size, template)
+        return template
+
+    def _recipient_chunks(self, path, chunksize, counts=None):
+        """Yield the valid, first-seen rows of a recipient list, chunk by chunk, with addresses normalized.
+
+        Addresses are stripped and lowercased, then validated and deduplicated a whole
+        chunk at a time. Duplicates are tracked across chunks by 64-bit address hashes.
+        When `counts` is given, valid, invalid and duplicate rows are added to it and
+        each invalid address is logged.
+        """
+        import numpy as np
+        import pandas as pd
+
+        seen = np.empty(0, dtype=np.uint64)
+        for chunk in read_recipient_chunks(path, chunksize):
+            if "email" not in chunk:
+                raise ValueError("Recipient list has no 'email' column.")
+            chunk["email"] = chunk["email"].str.strip().str.lower()
+            valid = chunk["email"].str.match(EMAIL_PATTERN)
+            if counts is not None:
+                for email in chunk["email"][~valid]:
+                    self.logger.warning(f"Invalid email: {email}")
+                    self.log_to_mongodb("send_email", {"recipient": email}, "Invalid email", level="WARNING")
+                counts["invalid"] += int((~valid).sum())
+            chunk = chunk[valid]
+
+            hashes = pd.util.hash_pandas_object(chunk["email"], index=False).to_numpy()
+            fresh = ~pd.Series(hashes).duplicated().to_numpy()
+            if len(seen):
+                # `seen` is kept sorted, so membership is a binary search per address
+                fresh &= seen[np.minimum(np.searchsorted(seen, hashes), len(seen) - 1)] != hashes
+            seen = np.sort(np.concatenate([seen, hashes[fresh]]))
+            if counts is not None:
+                counts["valid"] += int(fresh.sum())
+                counts["duplicate"] += int(len(fresh) - fresh.sum())
+            yield chunk[fresh]
+
+    def _dispatch_emails(self, messages, encoded, workers, rate, counts, on_result):
+        """Send (recipient, subject, body, message_id) messages from an iterable across `workers` threads.
+
+        Messages are pulled from `messages` through a small bounded queue, so the
+        recipient list is consumed as it is sent rather than held in full. Each
+        worker reuses a pooled SMTP session, and every message shares the `encoded`
+        attachments (see `_encode_attachments`). `rate` caps messages per second across
+        all workers; sends that had to wait for it are counted as throttled. Each
+        result goes to `on_result(recipient, error)`, whose returned outbox state
+        (sent, retry or failed) is counted in `counts` along with throttled sends.
+        If recording a result raises, no further messages are taken and the error
+        is raised once the workers have finished.
+        """
+        sender = os.getenv("SENDER_EMAIL")
+        bucket = TokenBucket(rate, max(rate, 1)) if rate else None
+        pending = queue.Queue(maxsize=workers * 4)
+        lock = threading.Lock()
+        errors = []
+        # Keep one idle session per worker, so sessions aren't closed and reopened between messages
+        self.smtp_pool.max_idle = max(self.smtp_pool.max_idle, workers)
+
+        def worker():
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                recipient, subject, body, message_id = item
+                throttled = bucket is not None and bucket.acquire() > 0
+                error = None
+                try:
+                    self.smtp_pool.send(sender, recipient, self._compose_email(sender, recipient, subject, body, encoded, message_id))
+                except Exception as e:
+                    error = e
+                # A worker that died here would leave the producer blocked on a full queue
+                try:
+                    self._email_result(recipient, subject, error, throttled, counts, on_result, lock)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker, name=f"send_email-{i}", daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for item in messages:
+                if errors:
+                    break
+                pending.put(item)
+        finally:
+            for _ in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    def _dispatch_emails_async(self, messages, encoded, workers, rate, counts, on_result):
+        """Like `_dispatch_emails`, but with `workers` SMTP sessions as coroutines on one event loop.
+
+        Messages are delivered by an AsyncSMTPEngine on a loop run in the calling
+        thread, with helper threads composing messages and recording results, so a
+        campaign's thread count doesn't grow with the sessions it keeps open.
+        """
+        import asyncio
+
+        sender = os.getenv("SENDER_EMAIL")
+        pool = self.smtp_pool
+        engine = AsyncSMTPEngine(pool.host, pool.port, pool.username, pool.password, pool.starttls, pool.max_messages, pool.timeout)
+        bucket = TokenBucket(rate, max(rate, 1)) if rate else None
+
+        lock = threading.Lock()
+
+        def done(recipient, error, throttled, subject):
+            self._email_result(recipient, subject, error, throttled, counts, on_result, lock)
+
+        def outgoing():
+            for recipient, subject, body, message_id in messages:
+                # A message that can't be composed (e.g. a header injected through a list field) fails on its own, as with threads
+                try:
+                    message = self._compose_email(sender, recipient, subject, body, encoded, message_id)
+                except Exception as e:
+                    done(recipient, e, False, subject)
+                    continue
+                yield recipient, message, subject
+
+        asyncio.run(engine.send_all(sender, outgoing(), workers, bucket, done))
+
+    def _email_result(self, recipient, subject, error, throttled, counts, on_result, lock):
+        """Log one list message's result, record it through `on_result` and count its outbox state.
+
+        Only the `counts` update takes `lock`; recording and logging run unlocked.
+        """
+        if error is not None:
+            self.logger.error(f"Failed to send email to {recipient}: {error}")
+        state = on_result(recipient, error)
+        with lock:
+            counts[state] += 1
+            counts["throttled"] += throttled
+        if state == "sent":
+            self.log_to_mongodb("send_email", {"recipient": recipient, "subject": subject}, "Email sent")
+        elif state == "retry":
+            self.log_to_mongodb("send_email", {"recipient": recipient, "subject": subject, "error": str(error)}, "Email retry scheduled", level="WARNING")
+        else:
+            self.log_to_mongodb("send_email", {"recipient": recipient, "subject": subject, "error": str(error)}, "Email failed", level="ERROR")
+
+    def _send_single_email(self, recipient_email, subject, message, attachments=None, encoded=None):
+        """Helper method to send a single email over a pooled SMTP session.
+
+        `encoded` are attachments already encoded for the run; otherwise `attachments` are encoded for this message.
+        """
+        SENDER_EMAIL = os.getenv("SENDER_EMAIL")
+        SENDER_PASSWORD = os.getenv("SENDER_PASSWORD")
+        # A relay configured through SMTP_HOST may accept mail without logging in
+        if not SENDER_EMAIL or not (SENDER_PASSWORD or os.getenv("SMTP_HOST")):
+            self.logger.error("Missing email credentials in .env file.")
+            return False
+
+        owns_attachments = encoded is None
+        if owns_attachments:
+            encoded = self._encode_attachments(attachments)
+        try:
+            self.smtp_pool.send(SENDER_EMAIL, recipient_email, self._compose_email(SENDER_EMAIL, recipient_email, subject, message, encoded))
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to send email to {recipient_email}: {e}")
+            return False
+        finally:
+            if owns_attachments:
+                for attachment in encoded:
+                    attachment.close()
+
+    def _encode_attachments(self, attachments):
+        """Encode each attachment's MIME part once, for every message of a run to share."""
+        encoded = []
+        for attachment in attachments or ():
+            try:
+                encoded.append(EncodedAttachment(attachment))
+            except FileNotFoundError:
+                self.logger.error(f"Attachment '{attachment}' not found.")
+        return encoded
+
+    def _compose_email(self, sender, recipient_email, subject, message, encoded, message_id=None):
+        """Build the per-recipient headers and text part, and attach the shared encoded parts."""
+        from email import policy
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
+        boundary = f"==============={os.urandom(8).hex()}=="
+        msg = MIMEMultipart(boundary=boundary)
+        msg["From"] = sender
+        msg["To"] = recipient_email
+        msg["Subject"] = subject
+        if message_id:
+            msg["Message-ID"] = message_id
+        msg.attach(MIMEText(message, "plain"))
+        data = msg.as_bytes(policy=policy.compat32.clone(linesep="\r\n"))
+        # Drop the closing delimiter: the attachments and a new closing delimiter follow
+        head = data[:data.rindex(b"--" + boundary.encode() + b"--")]
+        return OutgoingMessage(re.sub(rb"(?m)^\.", b"..", head), boundary.encode(), encoded)
+
+    def is_valid_email(self, email):
+        """Validate email format."""
+        return isinstance(email, str) and EMAIL_REGEX.match(email) is not None
+
+    def get_gold_rate(self):
+        """Scrape gold rates from a website and store in an Excel file."""
+        import requests
+        import pandas as pd
+        from bs4 import BeautifulSoup
+
+        url = "https://www.bankbazaar.com/gold-rate-tamil-nadu.html"
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+        }
+        response = requests.get(url, headers=headers)
+        if response.status_code != 200:
+            self.logger.error(f"Error fetching gold rates: {response.status_code}")
+            return None
+
+        soup = BeautifulSoup(response.text, "html.parser")
+        price_span = soup.find("span", class_="white-space-nowrap")
+        if price_span:
+            gold_price = price_span.get_text(strip=True)
+            self.logger.info(f"Gold rate: {gold_price}")
+
+            excel_file = "gold_rates.xlsx"
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+
+            try:
+                if os.path.exists(excel_file):
+                    df = pd.read_excel(excel_file)
+                    new_row = {"Timestamp": timestamp, "Gold Price": gold_price}
+                    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+                    df.to_excel(excel_file, index=False)
+                else:
+                    df = pd.DataFrame({"Timestamp": [timestamp], "Gold Price": [gold_price]})
+                    df.to_excel(excel_file, index=False)
+            except Exception as e:
+                self.logger.error(f"Error writing to excel file: {e}")
+
+            self.logger.info(f"Gold rate stored in {excel_file}")
+            self.log_to_mongodb("get_gold_rate", {"gold_price": gold_price, "timestamp": timestamp}, "Gold rate stored")
+
+            return gold_price
+        else:
+            self.logger.error("Gold price not found.")
+            return None
+
+    def convert_file(self, input_dir, output_dir, input_format, output_format, filenames=None):
+        """Convert files in the input directory to the output directory.
+
+        `filenames` limits the run to those files (used by watch mode).
+        """
+        try:
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+            for filename in (os.listdir(input_dir) if filenames is None else filenames):
+                if filename.lower().endswith(f".{input_format}"):
+                    input_path = os.path.join(input_dir, filename)
+                    output_filename = os.path.splitext(filename)[0] + f".{output_format}"
+                    output_path = os.path.join(output_dir, output_filename)
+
+                    try:
+                        if input_format == "txt" and output_format == "csv":
+                            with open(input_path, "r") as f:
+                                content = f.read()
+                            with open(output_path, "w") as f:
+                                f.write(content.upper())
+                        elif input_format == "txt" and output_format == "pdf":
+                            with open(input_path, "r") as f:
+                                content = f.read()
+                            from fpdf import FPDF
+
+                            pdf = FPDF()
+                            pdf.add_page()
+                            pdf.set_font("Arial", size=12)
+                            pdf.multi_cell(0, 10, content)
+                            pdf.output(output_path)
+                        elif input_format == "csv" and output_format == "xlsx":
+                            import pandas as pd
+
+                            df = pd.read_csv(input_path)
+                            df.to_excel(output_path, index=False)
+                        elif input_format == "docx" and output_format == "pdf":
+                            from docx import Document
+                            from fpdf import FPDF
+
+                            doc = Document(input_path)
+                            pdf = FPDF()
+                            pdf.add_page()
+                            for para in doc.paragraphs:
+                                pdf.set_font("Arial", size=12)
+                                pdf.multi_cell(0, 10, para.text)
+                            pdf.output(output_path)
+                        else:
+                            raise ValueError("Unsupported conversion format")
+
+                        self.logger.info(f"Converted '{input_path}' to '{output_path}'")
+                        self.log_to_mongodb("convert_file", {"input": input_path, "output": output_path}, "Conversion successful")
+
+                    except Exception as e:
+                        self.logger.error(f"Error converting file '{input_path}': {e}")
+                        self.log_to_mongodb("convert_file", {"input": input_path, "output": output_path}, f"Error: {e}", level="ERROR")
+
+            self.logger.info(f"Converted files from '{input_dir}' to '{output_dir}'")
+            self.log_to_mongodb("convert_file", {"input_dir": input_dir, "output_dir": output_dir}, "Conversion successful")
+
+        except Exception as e:
+            self.logger.error(f"Error converting files in directory: {e}")
+            self.log_to_mongodb("convert_file", {"input_dir": input_dir, "output_dir": output_dir}, f"Error: {e}", level="ERROR")
+
+    def compress_files(self, directory, output_dir, compression_format, io_ops=None, io_bytes=None, io_idle=None):
+        """Compress files in a directory, excluding the output directory.
+
+        `io_ops`, `io_bytes` and `io_idle` throttle the run (see `IOGovernor`): each
+        file counts as an operation, and its data is read through the byte budget.
+        """
+        import zipfile
+        import tarfile
+
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            governor = self._io_governor(io_ops, io_bytes, io_idle)
+
+            with governor.idle():
+                if compression_format == "zip":
+                    output_path = os.path.join(output_dir, os.path.basename(directory) + ".zip")
+                    with zipfile.ZipFile(output_path, 'w') as zipf:
+                        for root, _, files in os.walk(directory):
+                            for file in files:
+                                file_path = os.path.join(root, file)
+                                governor.op()
+                                # What ZipFile.write does, with the source read through the governor
+                                zinfo = zipfile.ZipInfo.from_file(file_path, os.path.relpath(file_path, directory))
+                                zinfo.compress_type = zipf.compression
+                                with open(file_path, "rb") as src, zipf.open(zinfo, "w") as dst:
+                                    shutil.copyfileobj(governor.reader(src), dst, HASH_CHUNK_SIZE)
+                elif compression_format == "tar":
+                    output_path = os.path.join(output_dir, os.path.basename(directory) + ".tar")
+                    with tarfile.open(output_path, 'w') as tarf:
+                        for filename in os.listdir(directory):
+                            filepath = os.path.join(directory, filename)
+                            if os.path.isfile(filepath):
+                                governor.op()
+                                with open(filepath, "rb") as f:
+                                    tarf.addfile(tarf.gettarinfo(filepath, arcname=filename), governor.reader(f))
+                else:
+                    raise ValueError("Unsupported compression format")
+
+            self.logger.info(f"Compressed '{directory}' to '{output_path}'")
+            self.log_to_mongodb("compress_files", {"directory": directory, "output": output_path}, "Compression successful")
+        except Exception as e:
+            self.logger.error(f"Error compressing files: {e}")
+            self.log_to_mongodb("compress_files", {"directory": directory, "output": output_dir}, f"Error: {e}", level="ERROR")
+    def add_task(self, interval, unit, task_type, **kwargs):
+        """Add a new task to the scheduler."""
+        filtered_kwargs = {k: v for k, v in kwargs.items() if v is not None}
+        new_task_details = {"interval": interval, "unit": unit, "task_type": task_type, **filtered_kwargs}
+        self._job_target(new_task_details)
+        self._job_options(new_task_details)
+
+        # The store rejects duplicates through its details hash
+        task_name = self.task_store.add(task_type, new_task_details)
+        if task_name is None:
+            print(f"Task Exists already {new_task_details}. Task not added.")
+            return None
+
+        if self.scheduler is not None:
+            self._schedule_task(task_name, new_task_details)
+
+        self.logger.info(f"Added task '{task_name}'")
+        self.log_to_mongodb("add_task", {"task_name": task_name, "details": new_task_details}, "Task added")
+
+        print(f"Task '{task_name}' added successfully.")
+        print(f"Task details: {new_task_details}")
+        return task_name
+
+    def remove_task(self, task_name):
+        """Remove a task from the scheduler."""
+        if self.task_store.remove(task_name):
+            if self.scheduler is not None and self.scheduler.get_job(task_name):
+                self.scheduler.remove_job(task_name)
+            self._stop_watcher(task_name)
+            self.logger.info(f"Removed task '{task_name}'")
+            self.log_to_mongodb("remove_task", {"task_name": task_name}, "Task removed")
+            print(f"Task '{task_name}' removed successfully.")
+            return True
+        else:
+            self.logger.warning(f"Task '{task_name}' not found")
+            self.log_to_mongodb("remove_task", {"task_name": task_name}, "Task not found", level="WARNING")
+            return False
+
+    def list_tasks(self):
+        """List all scheduled tasks."""
+        print_tasks(self.load_tasks())
+
+    def _job_target(self, details):
+        """Return the method, arguments and keyword options a task's details map to."""
+        task_type = details["task_type"]
+        if task_type == "organize_files":
+            options = {key: details[key] for key in ORGANIZE_OPTIONS if key in details}
+            if "layout" in options:
+                self._layout_fields(options["layout"])
+            return self.organize_files, [details["directory"]], options
+        elif task_type == "delete_files":
+            options = {key: details[key] for key in DELETE_OPTIONS if key in details}
+            if "quota" in options:
+                if parse_size(options.get("quota_low", options["quota"])) > parse_size(options["quota"]):
+                    raise ValueError("The low watermark (quota_low) must not be above the quota")
+            elif details.get("age_days") is None:
+                raise ValueError("delete_files needs age_days or a quota")
+            return self.delete_files, [details["directory"], details.get("age_days"), details.get("formats")], options
+        elif task_type == "send_email":
+            options = {key: details[key] for key in EMAIL_OPTIONS if key in details}
+            parse_rate(options.get("rate"))
+            if options.get("engine", "threads") not in EMAIL_ENGINES:
+                raise ValueError(f"Unknown email engine '{options['engine']}': use one of {', '.join(EMAIL_ENGINES)}")
+            return self.send_email, [details["recipient_email"], details["subject"], details["message"], details.get("attachments")], options
+        elif task_type == "get_gold_rate":
+            return self.get_gold_rate, [], {}
+        elif task_type == "convert_file":
+            return self.convert_file, [details["input_dir"], details["output_dir"], details["input_format"], details["output_format"]], {}
+        elif task_type == "compress_files":
+            return self.compress_files, [details["directory"], details["output_dir"], details["compression_format"]], {key: details[key] for key in IO_OPTIONS if key in details}
+        raise ValueError("Unsupported task type")
+
+    def _job_options(self, details):
+        """Return the executor and job options for a task: per-task values override the task-type route and defaults."""
+        options = {"executor": self.executor_routes.get(details["task_type"], "default")}
+        options.update({key: details[key] for key in JOB_OPTIONS if details.get(key) is not None})
+        if options["executor"] != "default" and options["executor"] not in EXECUTOR_POOLS:
+            raise ValueError(f"Unknown executor '{options['executor']}'")
+        # A process-pool worker would get its own IOGovernor and its own full budget, so throttled runs stay in this process
+        throttled = self.io_governor.limited or details.get("io_ops") or details.get("io_bytes")
+        if details["task_type"] in IO_TASKS and throttled and EXECUTOR_POOLS.get(options["executor"], ("thread",))[0] == "process":
+            options["executor"] = "files"
+        return options
+
+    def _job_callable(self, func, args, kwargs, executor):
+        """Wrap a job for process-pool executors: bound methods can't be pickled, so the worker builds its own TaskManager."""
+        if EXECUTOR_POOLS.get(executor, ("thread",))[0] == "process":
+            return run_task_in_process, [func.__name__, args, kwargs], {}
+        return func, args, kwargs
+
+    def _schedule_task(self, task_name, details):
+        """Add a job for a task to the scheduler, routed to its executor pool."""
+        from apscheduler.triggers.interval import IntervalTrigger
+
+        func, args, kwargs = self._job_target(details)
+        options = self._job_options(details)
+        func, args, kwargs = self._job_callable(func, args, kwargs, options["executor"])
+        trigger = IntervalTrigger(**{details["unit"]: details["interval"]})
+        self.scheduler.add_job(func, trigger, args=args, kwargs=kwargs, id=task_name, **options)
+        if details.get("watch"):
+            self._start_watcher(task_name, details)
+
+    def _start_watcher(self, task_name, details):
+        """Run a task on new files as they appear; its interval job remains as the reconcile scan."""
+        if details["task_type"] not in WATCHABLE_TASKS:
+            self.logger.warning(f"Watch mode is not supported for '{details['task_type']}'; '{task_name}' runs on its interval only.")
+            return
+        directory = details[WATCHABLE_TASKS[details["task_type"]]]
+        watcher = DirectoryWatcher(
+            directory,
+            lambda filenames: self._run_on_files(task_name, details, filenames),
+            self.logger,
+            debounce=float(details.get("debounce", 2)),
+        )
+        try:
+            watcher.start()
+        except ImportError:
+            self.logger.error(f"watchdog is not installed; '{task_name}' runs on its interval only.")
+            return
+        except OSError as e:
+            self.logger.error(f"Error watching '{directory}' for '{task_name}': {e}")
+            return
+        self.watchers[task_name] = watcher
+        self.logger.info(f"Watching '{directory}' for task '{task_name}'")
+
+    def _stop_watcher(self, task_name):
+        watcher = self.watchers.pop(task_name, None)
+        if watcher is not None:
+            watcher.stop()
+
+    def _run_on_files(self, task_name, details, filenames):
+        """Submit a one-off run of a watched task for the given files on its executor."""
+        func, args, kwargs = self._job_target(details)
+        options = self._job_options(details)
+        func, args, kwargs = self._job_callable(func, args, {**kwargs, "filenames": filenames}, options["executor"])
+        self.scheduler.add_job(func, args=args, kwargs=kwargs, name=f"{task_name} (watch)", executor=options["executor"])
+
+    def _on_job_executed(self, event):
+        """Forward log entries returned by process-pool jobs to the log writer."""
+        if isinstance(event.retval, dict) and "log_entries" in event.retval:
+            for log_entry in event.retval["log_entries"]:
+                self.log_writer.write(log_entry)
+
+    def load_and_schedule_tasks(self):
+        """Load and schedule tasks from the task store."""
+        tasks = self.load_tasks()
+        for task_name, details in tasks.items():
+            try:
+                self._schedule_task(task_name, details)
+            except (KeyError, ValueError) as e:
+                self.logger.error(f"Error scheduling task '{task_name}': {e}")
+
+    def handle_control_request(self, request):
+        """Apply a control request (add, remove, list, pause, resume, run_now) to the running scheduler."""
+        command = request.get("command")
+        if command == "list":
+            paused = [job.id for job in self.scheduler.get_jobs() if job.next_run_time is None]
+            return {"ok": True, "tasks": self.load_tasks(), "paused": paused}
+        if command == "add":
+            task_name = self.add_task(**request["task"])
+            if task_name is None:
+                details = {k: v for k, v in request["task"].items() if v is not None}
+                return {"ok": False, "message": f"Task Exists already {details}. Task not added."}
+            return {"ok": True, "message": f"Task '{task_name}' added successfully.", "task_name": task_name}
+
+        task_name = request.get("task_name")
+        if command == "remove":
+            if self.remove_task(task_name):
+                return {"ok": True, "message": f"Task '{task_name}' removed successfully."}
+            return {"ok": False, "message": f"Task '{task_name}' not found."}
+
+        job = self.scheduler.get_job(task_name)
+        if job is None:
+            return {"ok": False, "message": f"Task '{task_name}' not found."}
+        if command == "pause":
+            self.scheduler.pause_job(task_name)
+            status = "paused"
+        elif command == "resume":
+            self.scheduler.resume_job(task_name)
+            status = "resumed"
+        elif command == "run_now":
+            job.modify(next_run_time=datetime.now(self.scheduler.timezone))
+            status = "triggered"
+        else:
+            return {"ok": False, "message": f"Unsupported command: {command}"}
+        self.logger.info(f"Task '{task_name}' {status}")
+        self.log_to_mongodb(command, {"task_name": task_name}, f"Task {status}")
+        return {"ok": True, "message": f"Task '{task_name}' {status}."}
+
+    def _start_control_server(self):
+        """Listen for control requests on a Unix domain socket."""
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            self.logger.warning("Unix domain sockets are not available; control socket disabled.")
+            return None
+        if os.path.exists(self.control_socket):
+            if send_control_request(self.control_socket, {"command": "list"}, timeout=2) is not None:
+                raise RuntimeError(f"A scheduler is already listening on '{self.control_socket}'")
+            os.remove(self.control_socket)
+        server = socketserver.ThreadingUnixStreamServer(self.control_socket, ControlRequestHandler)
+        server.daemon_threads = True
+        server.manager = self
+        os.chmod(self.control_socket, 0o600)
+        threading.Thread(target=server.serve_forever, name="control-server", daemon=True).start()
+        self.logger.info(f"Control socket listening on '{self.control_socket}'")
+        return server
+
+    def start_scheduler(self):
+        """Start the control socket and then the scheduler; return False if another scheduler is running."""
+        # Claim the socket first, so a second scheduler gives up before any job or watcher runs twice
+        try:
+            self.control_server = self._start_control_server()
+        except RuntimeError as e:
+            self.logger.error(f"{e}; not starting.")
+            for task_name in list(self.watchers):
+                self._stop_watcher(task_name)
+            self.log_writer.close()
+            return False
+        self.scheduler.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Scheduler stopped.")
+            self.stop_scheduler()
+        return True
+
+    def stop_scheduler(self):
+        """Shut down the control socket and scheduler, then drain the log writer."""
+        if self.control_server is not None:
+            self.control_server.shutdown()
+            self.control_server.server_close()
+            if os.path.exists(self.control_socket):
+                os.remove(self.control_socket)
+            self.control_server = None
+        for task_name in list(self.watchers):
+            self._stop_watcher(task_name)
+        self.scheduler.shutdown()
+        if self._smtp_pool is not None:
+            self._smtp_pool.close()
+        if self._email_outbox is not None:
+            self._email_outbox.close()
+        self.log_writer.close()
+
+
+def print_tasks(tasks, paused=()):
+    """Print tasks the way the list command shows them."""
+    if not tasks:
+        print("No tasks scheduled.")
+    else:
+        print("Scheduled tasks:")
+        for task_name, details in tasks.items():
+            filtered_details = {k: v for k, v in details.items() if v is not None}
+            state = " (paused)" if task_name in paused else ""
+            print(f"- {task_name}{state}: {filtered_details}")
+
+# CLI Interface
+def main():
+    """Run the task manager command line (see task_manager.py)."""
+    parser = argparse.ArgumentParser(description="Task Manager CLI", formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    # Add Task Parser
+    add_parser = subparsers.add_parser("add", help="Add a new task", formatter_class=argparse.RawTextHelpFormatter)
+    add_parser.add_argument("--interval", type=int, required=True, help="Interval for the task")
+    add_parser.add_argument("--unit", type=str, required=True, choices=["seconds", "minutes", "hours", "days"], help="Time unit for the interval")
+    add_parser.add_argument("--task-type", type=str, required=True, choices=["organize_files", "delete_files", "send_email", "get_gold_rate", "convert_file", "compress_files"], help="Type of task")
+    add_parser.add_argument("--directory", type=str, help="Directory for file tasks")
+    add_parser.add_argument("--age-days", type=int, help="Age in days for file deletion")
+    add_parser.add_argument("--formats", nargs="*", help="File formats for deletion or conversion")
+    add_parser.add_argument("--recipient-email", type=str, help="Recipient email address")
+    add_parser.add_argument("--subject", type=str, help="Email subject; for lists, a template like the message")
+    add_parser.add_argument("--message", type=str, help="Email message, or a file holding it; for lists, a template with {column} or {column|default} placeholders")
+    add_parser.add_argument("--attachments", nargs="*", help="Email attachments")
+    add_parser.add_argument("--input-dir", type=str, help="Input directory for conversion")
+    add_parser.add_argument("--output-dir", type=str, help="Output directory for conversion")
+    add_parser.add_argument("--input-format", type=str, help="Input file format for conversion")
+    add_parser.add_argument("--output-format", type=str, help="Output file format for conversion")
+    add_parser.add_argument("--compression-format", type=str, choices=["zip", "tar"], help="Compression format (zip or tar)")
+    add_parser.add_argument("--recursive", action="store_true", default=None, help="Organize files in subdirectories too (organize_files)")
+    add_parser.add_argument("--include", nargs="*", help="Glob patterns of files to organize, relative to --directory")
+    add_parser.add_argument("--exclude", nargs="*", help="Glob patterns of files or subdirectories to skip, relative to --directory (delete_files: files to keep)")
+    add_parser.add_argument("--prune", nargs="*", help="Glob patterns of subdirectories not to descend into (delete_files)")
+    add_parser.add_argument("--max-depth", type=int, help="Directory levels below --directory to walk, 0 for the top level only (delete_files)")
+    add_parser.add_argument("--workers", type=int, help="Worker threads for scanning and moving (organize_files), walking (delete_files) or sending (send_email)")
+    add_parser.add_argument("--rate", type=str, help="Maximum send rate for send_email lists, e.g. '10/s' or '600/min'")
+    add_parser.add_argument("--engine", type=str, choices=EMAIL_ENGINES, help="Delivery engine for send_email lists (default: EMAIL_ENGINE or threads)")
+    add_parser.add_argument("--campaign", type=str, help="Outbox campaign id for send_email lists (default: derived from the list, subject, message and attachments)")
+    add_parser.add_argument("--index", action="store_true", default=None, help="Keep a persistent expiry index, so runs only rescan changed directories (delete_files)")
+    add_parser.add_argument("--quota", type=str, help="Keep the directory's disk usage under this size, e.g. '200G', evicting the oldest files (delete_files)")
+    add_parser.add_argument("--quota-low", type=str, help="Once over --quota, evict down to this size (low watermark; default: --quota)")
+    add_parser.add_argument("--io-ops", type=float, help="Limit file operations per second (organize_files, delete_files, compress_files)")
+    add_parser.add_argument("--io-bytes", type=str, help="Limit bytes read per second, e.g. '50M' (organize_files, delete_files, compress_files)")
+    add_parser.add_argument("--io-idle", action="store_true", default=None, help="Run at idle I/O priority on Linux (organize_files, delete_files, compress_files)")
+    add_parser.add_argument("--evict-by", type=str, choices=["mtime", "atime"], help="Evict the least recently modified (default) or accessed files first")
+    add_parser.add_argument("--layout", type=str, help="Destination layout for organize_files, e.g. '{category}/{YYYY}/{MM}' or '{category}/{hash}'")
+    add_parser.add_argument("--max-per-folder", type=int, help="Spill into numbered subfolders once a destination folder holds this many entries")
+    add_parser.add_argument("--sniff", type=str, choices=["off", "unknown", "all"], help="Classify by magic bytes: for unrecognised extensions only, or for every file (organize_files)")
+    add_parser.add_argument("--dedup", type=str, choices=DEDUP_ACTIONS, help="Find duplicate files before organizing: report, hardlink, move to Duplicates/, or delete (organize_files)")
+    add_parser.add_argument("--watch", action="store_true", default=None, help="Also run on new files as they appear (organize_files, convert_file); --interval sets the reconcile scan")
+    add_parser.add_argument("--debounce", type=float, help="Seconds of quiet before handling a burst of new files in watch mode (default 2)")
+    add_parser.add_argument("--executor", type=str, choices=["default", *EXECUTOR_POOLS], help="Executor pool for the task (default: routed by task type)")
+    add_parser.add_argument("--max-instances", type=int, help="Maximum concurrently running instances of the task")
+    add_parser.add_argument("--coalesce", type=str, choices=["true", "false"], help="Run a backlog of missed runs only once")
+    add_parser.add_argument("--misfire-grace-time", type=int, help="Seconds a late run may still start")
+
+    add_parser.epilog = """
+Available tasks:
+
+  📂 organize_files: Organize files in a directory.
+  🗑️ delete_files: Delete files older than a specified age.
+  📧 send_email: Send an email.
+  🥇 get_gold_rate: Scrape and store gold rates.
+  🔄 convert_file: Convert files in a directory. Supported conversions:
+    - txt to csv
+    - txt to pdf
+    - csv to xlsx
+    - docx to pdf
+  🗜️ compress_files: Compress files in a directory.
+
+Example usage:
+  organize_files: python task_manager.py add --interval 1 --unit days --task-type organize_files --directory '/path/to/directory'
+  delete_files: python task_manager.py add --interval 1 --unit days --task-type delete_files --directory '/path/to/directory' --age-days 30 --formats .txt .log
+  send_email: python task_manager.py add --interval 1 --unit days --task-type send_email --recipient-email 'recipient@example.com' --subject 'Subject' --message 'Message' --attachments '/path/to/file1.txt' '/path/to/file2.pdf'
+  get_gold_rate: python task_manager.py add --interval 1 --unit hours --task-type get_gold_rate
+  convert_file: python task_manager.py add --interval 1 --unit days --task-type convert_file --input-dir '/path/to/input' --output-dir '/path/to/output' --input-format txt --output-format pdf
+  compress_files: python task_manager.py add --interval 1 --unit days --task-type compress_files --directory '/path/to/directory' --output-dir '/path/to/output' --compression-format zip
+
+Recursive organize:
+  --recursive moves files from the whole tree into the top-level category folders, with
+  --workers threads partitioned by subdirectory. Name collisions get ' (1)', ' (2)', ...
+  suffixes in sorted path order, e.g.
+    python task_manager.py add --interval 1 --unit days --task-type organize_files --directory '/share' --recursive --exclude '.git' '*.tmp' --workers 16
+
+Deleting in large trees:
+  delete_files walks subdirectories in parallel (--workers, default 4). --exclude keeps
+  matching files, --prune skips matching subdirectories and --max-depth limits the walk.
+  Deletions are logged in batches of counts, bytes freed and sample paths, e.g.
+    python task_manager.py add --interval 1 --unit days --task-type delete_files --directory '/var/log/app' --age-days 30 --formats .log .gz --prune '.snapshots' --max-depth 3
+  --index keeps the matching files and their mtimes in EXPIRY_INDEX_PATH (default
+  expiry_index.db). After the first run, only directories whose mtime changed are
+  rescanned, and expired files have their mtime checked again before deletion. A file
+  whose mtime is set back without touching its directory is only seen on a rescan.
+  --quota keeps a directory under a size budget. Usage is measured in one walk, and once
+  it is over --quota the oldest files (--evict-by mtime or atime) are deleted until it is
+  under --quota-low. --age-days and --formats are optional then, e.g.
+    python task_manager.py add --interval 1 --unit hours --task-type delete_files --directory '/var/cache/app' --quota 200G --quota-low 180G
+
+I/O throttling:
+  organize_files, delete_files and compress_files share token-bucket limits on file
+  operations per second (IO_OPS_PER_SECOND) and bytes read per second (IO_BYTES_PER_SECOND),
+  and can run at idle I/O priority on Linux (IO_IDLE_PRIORITY=true). Per task, --io-ops,
+  --io-bytes and --io-idle apply on top of the shared limits. Scanning, content sniffing
+  and --dedup hashing are throttled as well as moves, deletions and archive reads. The
+  budgets are kept per scheduler process, so while any ops or bytes limit applies these
+  tasks run on the files thread pool, even where their route is a process pool (compress_files
+  is routed to cpu by default), e.g.
+    python task_manager.py add --interval 1 --unit days --task-type compress_files --directory '/data' --output-dir '/backup' --compression-format tar --io-bytes 50M --io-idle
+
+Destination layout:
+  --layout shards category folders: {category}, {YYYY}/{MM}/{DD} (file mtime), {hash}
+  (two hex digits of the file name hash). --max-per-folder spills full folders into
+  numbered subfolders (0001, 0002, ...), e.g.
+    python task_manager.py add --interval 1 --unit days --task-type organize_files --directory '/path/to/directory' --layout '{category}/{YYYY}/{MM}' --max-per-folder 10000
+
+Content sniffing:
+  --sniff unknown reads the first 512 bytes of files with unrecognised extensions (--sniff all:
+  every file) and classifies them by magic bytes. Signatures many formats share (zip, OLE,
+  XML, #! scripts) only classify unrecognised extensions, so e.g. .docx, .svg and .py files
+  keep their extension's category under --sniff all. Results are cached in FILE_CACHE_PATH
+  (default file_cache.db, at most FILE_CACHE_MAX_ENTRIES entries, least recently used evicted).
+
+Duplicates:
+  --dedup report|hardlink|move|delete compares files by size, then a head/tail hash, then a
+  full SHA-256 (cached in FILE_CACHE_PATH), against each other and the already organized
+  files. The organized copy, or else the first in path order, is kept. Moves and deletes
+  are journaled with the run; undo restores moved duplicates, not deleted ones, e.g.
+    python task_manager.py add --interval 1 --unit days --task-type organize_files --directory '/path/to/downloads' --dedup move
+
+Watch mode:
+  --watch handles new files as soon as they appear (inotify via watchdog); the interval
+  becomes a low-frequency full reconcile scan that catches missed events, e.g.
+    python task_manager.py add --interval 6 --unit hours --task-type organize_files --directory '/path/to/directory' --watch
+
+Executor pools:
+  network (threads): send_email, get_gold_rate
+  files (threads): organize_files, delete_files
+  cpu (processes): convert_file, compress_files
+  Pool sizes: NETWORK_POOL_SIZE, FILES_POOL_SIZE, CPU_POOL_SIZE. Per task type: EXECUTOR_ROUTES='send_email=network,convert_file=cpu'.
+  Per task: --executor, --max-instances, --coalesce, --misfire-grace-time, e.g.
+    python task_manager.py add --interval 1 --unit hours --task-type convert_file ... --executor cpu --max-instances 2
+
+Email delivery:
+  send_email keeps authenticated SMTP sessions open across recipients. Server:
+  SMTP_HOST (default smtp.gmail.com), SMTP_PORT (587), SMTP_STARTTLS (true); login uses
+  SENDER_EMAIL/SENDER_PASSWORD and is skipped without a password. A session is replaced
+  after SMTP_MAX_MESSAGES_PER_CONNECTION (100) messages, SMTP_IDLE_TIMEOUT (30) idle
+  seconds, or an SMTP error.
+  CSV/XLSX lists are read RECIPIENT_CHUNK_SIZE (50000) rows at a time; addresses are
+  lowercased, validated and deduplicated, and the valid/invalid/duplicate counts logged,
+  before sending starts. They are sent by --workers threads (default EMAIL_WORKERS=4) at no more than
+  --rate messages (default EMAIL_RATE, unlimited), e.g.
+    python task_manager.py add --interval 1 --unit days --task-type send_email --recipient-email list.csv --subject 'News' --message message.txt --workers 8 --rate 500/min
+  List recipients are queued per campaign in EMAIL_OUTBOX_PATH (default email_outbox.db)
+  and each one is marked sent, retry or failed as soon as its send finishes. A run that
+  was interrupted resumes with the recipients not yet sent, and a campaign that runs again
+  only mails recipients added to the list since (a warning is logged when nobody is left).
+  A campaign is the same list path, subject, message and attachments (path, size and
+  modification time), unless named with --campaign; use a new --campaign name (or change
+  the message) to send to everyone again. Transient failures are retried up to
+  EMAIL_MAX_ATTEMPTS (5) times, waiting EMAIL_RETRY_BASE (30) seconds doubled per attempt,
+  at most EMAIL_RETRY_MAX (900), with random jitter. The run ends rather than waiting:
+  the scheduler runs the campaign again when its earliest retry is due, and otherwise
+  its next run sends the retries, e.g.
+    python task_manager.py add --interval 1 --unit hours --task-type send_email --recipient-email signups.csv --subject 'Welcome' --message welcome.txt --campaign welcome
+  For lists, the message and subject are templates: {column} is replaced by the row's
+  value in that column of the list, and {column|default} falls back to default where
+  the column is missing or empty ({{ and }} are literal braces). A {column} without a
+  default that names no column of the list is rendered empty, with a warning. Existing list
+  messages change meaning: any {word} in them is now a field and {{ or }} a single brace,
+  so literal braces must be doubled. A message file is compiled once and recompiled only
+  when it changes, e.g.
+    python task_manager.py add --interval 1 --unit days --task-type send_email --recipient-email list.csv --subject '{subject|Monthly news}' --message message.txt
+  --engine asyncio (or EMAIL_ENGINE=asyncio) sends a list from one event loop instead of
+  worker threads, keeping --workers SMTP sessions open at once. Each message's MAIL, RCPT
+  and DATA are pipelined where the server supports it, and connecting or delivering a
+  message is cancelled after SMTP_TIMEOUT (30) seconds, e.g.
+    python task_manager.py add --interval 1 --unit days --task-type send_email --recipient-email list.csv --subject 'News' --message message.txt --engine asyncio --workers 50
+"""
+
+    # Remove Task Parser
+    remove_parser = subparsers.add_parser("remove", help="Remove a task", formatter_class=argparse.RawTextHelpFormatter)
+    remove_parser.add_argument("--task-name", type=str, required=True, help="Name of the task to remove (e.g., 'organize_files_task_1')")
+    remove_parser.epilog = """
+Example usage:
+  python task_manager.py remove --task-name organize_files_task_1
+"""
+
+    # List Tasks Parser
+    list_parser = subparsers.add_parser("list", help="List all scheduled tasks", formatter_class=argparse.RawTextHelpFormatter)
+    list_parser.epilog = """
+Example usage:
+  python task_manager.py list
+"""
+
+    # Reshard Parser
+    reshard_parser = subparsers.add_parser("reshard", help="Re-shard an existing flat category folder in place", formatter_class=argparse.RawTextHelpFormatter)
+    reshard_parser.add_argument("--directory", type=str, required=True, help="Organized directory holding the category folder")
+    reshard_parser.add_argument("--category", type=str, required=True, help="Category folder to re-shard (e.g., 'Images')")
+    reshard_parser.add_argument("--layout", type=str, default="{category}", help="Destination layout, e.g. '{category}/{YYYY}/{MM}'")
+    reshard_parser.add_argument("--max-per-folder", type=int, help="Spill into numbered subfolders once a folder holds this many entries")
+    reshard_parser.add_argument("--workers", type=int, default=1, help="Worker threads for moving files")
+    reshard_parser.epilog = """
+Example usage:
+  python task_manager.py reshard --directory '/path/to/directory' --category Images --layout '{category}/{YYYY}/{MM}'
+  python task_manager.py reshard --directory '/path/to/directory' --category Documents --max-per-folder 10000
+"""
+
+    # Undo Parser
+    undo_parser = subparsers.add_parser("undo", help="Move the files of an organize or reshard run back", formatter_class=argparse.RawTextHelpFormatter)
+    undo_target = undo_parser.add_mutually_exclusive_group(required=True)
+    undo_target.add_argument("--run-id", type=str, help="Run to undo, as logged in the organize summary (run_id)")
+    undo_target.add_argument("--directory", type=str, help="Undo the latest run that moved files in this directory")
+    undo_parser.epilog = """
+Every reshard run, and every organize run with --recursive, --include, --exclude,
+--layout, --max-per-folder, --sniff or --dedup, writes its plan and progress to a journal
+in ORGANIZE_JOURNAL_DIR (default organize_journals; the newest ORGANIZE_JOURNAL_KEEP=20
+finished runs are kept). An interrupted run is resumed from its journal the next time
+it runs for the same directory. Plain organize runs move each top-level file with a
+single rename and are not journaled, so they can't be undone.
+
+Example usage:
+  python task_manager.py undo --directory '/path/to/directory'
+  python task_manager.py undo --run-id organize_files-20240101T120000000000-0123456789ab
+"""
+
+    # Pause/Resume/Run-now Parsers (these need a running scheduler)
+    for command, help_text in (("pause", "Pause a task in the running scheduler"), ("resume", "Resume a paused task in the running scheduler"), ("run-now", "Run a task immediately in the running scheduler")):
+        control_parser = subparsers.add_parser(command, help=help_text, formatter_class=argparse.RawTextHelpFormatter)
+        control_parser.add_argument("--task-name", type=str, required=True, help="Name of the task (e.g., 'organize_files_task_1')")
+        control_parser.epilog = f"""
+Example usage:
+  python task_manager.py {command} --task-name organize_files_task_1
+"""
+
+    # Start Scheduler Parser
+    start_parser = subparsers.add_parser("start", help="Start the scheduler", formatter_class=argparse.RawTextHelpFormatter)
+    start_parser.epilog = """
+Example usage:
+  pythonw task_manager.py start
+"""
+
+    # Custom help message
+    parser.epilog = """
+Subcommands:
+  add       Add a new task. Example usage: python task_manager.py add -h
+  remove    Remove a task. Example usage: python task_manager.py remove -h
+  list      List all scheduled tasks. Example usage: python task_manager.py list -h
+  start     Start the scheduler. Example usage: python task_manager.py start -h
+  pause     Pause a task in the running scheduler. Example usage: python task_manager.py pause -h
+  resume    Resume a paused task in the running scheduler. Example usage: python task_manager.py resume -h
+  run-now   Run a task immediately in the running scheduler. Example usage: python task_manager.py run-now -h
+  reshard   Re-shard an existing flat category folder. Example usage: python task_manager.py reshard -h
+  undo      Undo an organize or reshard run. Example usage: python task_manager.py undo -h
+
+While the scheduler is running (start), add/remove/list are sent to it over
+its control socket (CONTROL_SOCKET, default task_manager.sock), so changes
+take effect without a restart.
+
+For more details on each subcommand, use the -h option with the subcommand.
+"""
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    add_kwargs = None
+    if args.command == "add":
+        add_kwargs = dict(
+            interval=args.interval,
+            unit=args.unit,
+            task_type=args.task_type,
+            directory=args.directory,
+            age_days=args.age_days,
+            formats=args.formats,
+            recipient_email=args.recipient_email,
+            subject=args.subject,
+            message=args.message,
+            attachments=args.attachments,
+            input_dir=args.input_dir,
+            output_dir=args.output_dir,
+            input_format=args.input_format,
+            output_format=args.output_format,
+            compression_format=args.compression_format,
+            recursive=args.recursive,
+            include=args.include,
+            exclude=args.exclude,
+            prune=args.prune,
+            max_depth=args.max_depth,
+            workers=args.workers,
+            rate=args.rate,
+            campaign=args.campaign,
+            engine=args.engine,
+            index=args.index,
+            quota=args.quota,
+            quota_low=args.quota_low,
+            evict_by=args.evict_by,
+            io_ops=args.io_ops,
+            io_bytes=args.io_bytes,
+            io_idle=args.io_idle,
+            layout=args.layout,
+            max_per_folder=args.max_per_folder,
+            sniff=args.sniff,
+            dedup=args.dedup,
+            watch=args.watch,
+            debounce=args.debounce,
+            executor=args.executor,
+            max_instances=args.max_instances,
+            coalesce=None if args.coalesce is None else args.coalesce == "true",
+            misfire_grace_time=args.misfire_grace_time,
+        )
+
+    # Send task commands to a running scheduler if there is one
+    if args.command in ("add", "remove", "list", "pause", "resume", "run-now"):
+        request = {"command": args.command.replace("-", "_")}
+        if args.command == "add":
+            request["task"] = add_kwargs
+        elif args.command != "list":
+            request["task_name"] = args.task_name
+        response = send_control_request(os.getenv("CONTROL_SOCKET", DEFAULT_CONTROL_SOCKET), request)
+        if response is not None:
+            if args.command == "list" and response["ok"]:
+                print_tasks(response["tasks"], response["paused"])
+            else:
+                print(response["message"])
+            sys.exit(0 if response["ok"] else 1)
+        if args.command in ("pause", "resume", "run-now"):
+            print("Scheduler is not running. Start it with: python task_manager.py start")
+            sys.exit(1)
+
+    # Don't load tasks or start watchers next to a scheduler that is already running
+    control_socket = os.getenv("CONTROL_SOCKET", DEFAULT_CONTROL_SOCKET)
+    if args.command in (None, "start") and send_control_request(control_socket, {"command": "list"}, timeout=2) is not None:
+        print(f"A scheduler is already running (control socket '{control_socket}').")
+        sys.exit(1)
+
+    # Create TaskManager object; only the scheduler needs MongoDB and APScheduler
+    manager = TaskManager(start_services=args.command in (None, "start"))
+
+    # Handle commands
+    if args.command == "add":
+        manager.add_task(**add_kwargs)
+    elif args.command == "remove":
+        manager.remove_task(args.task_name)
+    elif args.command == "list":
+        manager.list_tasks()
+    elif args.command == "reshard":
+        manager.reshard_folder(args.directory, args.category, args.layout, args.max_per_folder, args.workers)
+    elif args.command == "undo":
+        sys.exit(0 if manager.undo_organize(args.run_id, args.directory) else 1)
+    elif args.command == "start":
+        sys.exit(0 if manager.start_scheduler() else 1)
+    else:
+        parser.print_help()
+
+    # Start the scheduler thread only if no other command is given
+    if not args.command:
+        scheduler_thread = threading.Thread(target=manager.start_scheduler, daemon=True)
+        scheduler_thread.start()
+        print("Scheduler started in the background.")
+
+        try:
+            # The thread only returns early if another scheduler already holds the control socket
+            while scheduler_thread.is_alive():
+                time.sleep(1)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            print("Scheduler stopped.")
+            manager.stop_scheduler()